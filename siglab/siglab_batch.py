@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""Headless batch analysis of a directory tree of wav files.
+
+Runs SignalLab.pitch_features() and find_stacks() on every matching file
+using a pool of processes, and writes the per-frame features and stacks to
+one output file. matplotlib.pyplot is never imported.
+
+Output format is chosen by the extension of the output file:
+    .jsonl  one JSON record per file, written as each file finishes
+    .npz    columns of all files concatenated - see write_npz()
+
+A file that fails to load or analyze gets a record with an 'error' message;
+the rest of the run is not affected.
+
+Example:
+    python siglab_batch.py motifs/ motifs.npz --jobs 8
+"""
+
+import argparse
+import fnmatch
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import numpy
+import signal_lab
+
+def find_files(top, pattern='*_motif_*.wav'):
+    """Return sorted list of paths under directory top matching pattern."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(top):
+        for filename in fnmatch.filter(filenames, pattern):
+            paths.append(os.path.join(dirpath, filename))
+    return sorted(paths)
+
+def analyze_file(args):
+    """Analyze one file. Runs in a worker process.
+
+    Args:
+        args (tuple): (index, path, params) - params is dict with keys
+            blocksize, overlap, threshold, max_pitch_freq, mmap
+
+    Returns:
+        dict - see write_jsonl() for keys
+    """
+    index, path, params = args
+    start = time.time()
+    try:
+        data = signal_lab.SignalLab(path, max_pitch_freq=params['max_pitch_freq'],
+                                    mmap=params['mmap'])
+        t, pitch, goodness, entropy = data.pitch_features(params['blocksize'],
+                                                          params['overlap'])
+        stacks, goodness_threshold = [], None
+        if params['threshold'] and len(t):
+            stacks, goodness_threshold = signal_lab.find_stacks(
+                t, pitch, goodness, params['threshold'])
+            goodness_threshold = float(goodness_threshold)
+        return {'index': index, 'path': path,
+                'sample_rate': data.sample_rate,
+                'max_pitch_freq': data.max_pitch_freq,
+                'time': t, 'pitch': pitch, 'goodness': goodness,
+                'entropy': entropy,
+                'goodness_threshold': goodness_threshold,
+                'stacks': stacks,
+                'seconds': time.time() - start}
+    except Exception as e:
+        return {'index': index, 'path': path,
+                'error': '{}: {}'.format(type(e).__name__, e),
+                'traceback': traceback.format_exc(),
+                'seconds': time.time() - start}
+
+def run(paths, params, jobs=None, progress=True):
+    """Generator - analyze paths in a process pool, yield results as they finish.
+
+    Args:
+        paths (list of str): files to analyze
+        params (dict): see analyze_file()
+        jobs (int): number of worker processes, default is number of CPUs
+        progress (bool): if True, write a line per file to stderr
+    """
+    tasks = [(i, path, params) for i, path in enumerate(paths)]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for n_done, result in enumerate(
+                pool.imap_unordered(analyze_file, tasks, chunksize=4), 1):
+            if progress:
+                status = 'ERROR ' + result['error'] if 'error' in result else \
+                         '{} stacks'.format(len(result['stacks']))
+                sys.stderr.write('[{}/{}] {} ({:.2f}s) {}\n'.format(
+                    n_done, len(tasks), result['path'], result['seconds'], status))
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def write_jsonl(results, out_path):
+    """Write one JSON record per result, as they arrive.
+
+    Record keys: path, sample_rate, max_pitch_freq, time, pitch, goodness,
+    entropy (lists, one value per frame), goodness_threshold, stacks (list of
+    [start time, duration, list of pitches]), or path and error.
+
+    Returns:
+        (number of files, number of errors)
+    """
+    n_files = n_errors = 0
+    with open(out_path, 'w') as f:
+        for result in results:
+            n_files += 1
+            record = {'path': result['path']}
+            if 'error' in result:
+                n_errors += 1
+                record['error'] = result['error']
+            else:
+                for key in ('sample_rate', 'max_pitch_freq', 'goodness_threshold'):
+                    record[key] = result[key]
+                for key in ('time', 'pitch', 'goodness', 'entropy'):
+                    record[key] = result[key].tolist()
+                record['stacks'] = [list(stack) for stack in result['stacks']]
+            f.write(json.dumps(record) + '\n')
+    return n_files, n_errors
+
+def write_npz(results, out_path):
+    """Write all results as columns of one compressed npz file.
+
+    Arrays:
+        path, sample_rate, goodness_threshold - one entry per analyzed file
+        frame_file, time, pitch, goodness, entropy - one entry per frame,
+            frame_file is index into path
+        stack_file, stack_start, stack_dur, stack_n_pitches - one entry per
+            stack; the pitches of all stacks are concatenated in stack_pitch
+        error_path, error - files that could not be analyzed
+
+    Returns:
+        (number of files, number of errors)
+    """
+    results = sorted(results, key=lambda result: result['index'])
+    good = [result for result in results if 'error' not in result]
+    bad = [result for result in results if 'error' in result]
+    stacks = [(i, stack) for i, result in enumerate(good)
+              for stack in result['stacks']]
+
+    def column(key, dtype=numpy.float64):
+        if not good:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.concatenate([result[key] for result in good]).astype(dtype)
+
+    numpy.savez_compressed(
+        out_path,
+        path=numpy.array([result['path'] for result in good], dtype=str),
+        sample_rate=numpy.array([result['sample_rate'] for result in good]),
+        goodness_threshold=numpy.array(
+            [numpy.nan if result['goodness_threshold'] is None
+             else result['goodness_threshold'] for result in good]),
+        frame_file=numpy.repeat(numpy.arange(len(good), dtype=numpy.int32),
+                                [len(result['time']) for result in good]),
+        time=column('time'),
+        pitch=column('pitch', numpy.float32),
+        goodness=column('goodness', numpy.float32),
+        entropy=column('entropy', numpy.float32),
+        stack_file=numpy.array([i for i, stack in stacks], dtype=numpy.int32),
+        stack_start=numpy.array([stack[0] for i, stack in stacks]),
+        stack_dur=numpy.array([stack[1] for i, stack in stacks]),
+        stack_n_pitches=numpy.array([len(stack[2]) for i, stack in stacks],
+                                    dtype=numpy.int32),
+        stack_pitch=numpy.array([p for i, stack in stacks for p in stack[2]],
+                                dtype=numpy.float32),
+        error_path=numpy.array([result['path'] for result in bad], dtype=str),
+        error=numpy.array([result['error'] for result in bad], dtype=str))
+    return len(results), len(bad)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Analyze a directory tree of wav files with SignalLab.')
+    parser.add_argument('top', help='directory to search')
+    parser.add_argument('out', help='output file, .jsonl or .npz')
+    parser.add_argument('--pattern', default='*_motif_*.wav',
+                        help='file name pattern (default %(default)s)')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='worker processes (default: number of CPUs)')
+    parser.add_argument('--blocksize', type=int, default=1024)
+    parser.add_argument('--overlap', type=float, default=.50)
+    parser.add_argument('--threshold', type=float, default=.25)
+    parser.add_argument('--max-pitch-freq', type=float, default=4.2e3)
+    parser.add_argument('--mmap', action='store_true',
+                        help='memory-map wav files instead of reading them')
+    parser.add_argument('--quiet', action='store_true',
+                        help='no per-file progress lines')
+    args = parser.parse_args(argv)
+
+    if args.out.endswith('.jsonl'):
+        write = write_jsonl
+    elif args.out.endswith('.npz'):
+        write = write_npz
+    else:
+        parser.error('output file must end in .jsonl or .npz')
+
+    paths = find_files(args.top, args.pattern)
+    params = {'blocksize': args.blocksize, 'overlap': args.overlap,
+              'threshold': args.threshold,
+              'max_pitch_freq': args.max_pitch_freq, 'mmap': args.mmap}
+    start = time.time()
+    n_files, n_errors = write(run(paths, params, args.jobs, not args.quiet),
+                              args.out)
+    sys.stderr.write('{} files, {} errors, {:.1f}s\n'.format(
+        n_files, n_errors, time.time() - start))
+    return 1 if n_errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""Benchmarks of SignalLab hot paths on synthetic sound files.
+
+Writes synthetic wav files (harmonic stacks separated by noise, and/or pure
+noise), then times loading, single-frame power spectrum and cepstrum,
+goodness_of_pitch() for each blocksize and overlap, a sweep() over all of
+them plus thresholds and max pitch freqs, and spectrogram(). Each
+benchmark records best and mean time of several runs, and peak memory
+allocated during one run (Python 3 only - uses tracemalloc, which numpy
+reports its arrays to).
+
+Results are saved as JSON so runs can be compared over time:
+    python siglab_bench.py --out before.json
+    ... change code ...
+    python siglab_bench.py --out after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import wave
+
+import numpy
+import signal_lab
+
+try:
+    import tracemalloc
+except ImportError: # Python 2
+    tracemalloc = None
+
+def make_stack_wav(path, duration=10.0, sample_rate=44100, pitch=600.0,
+                   n_harmonics=8, stack_dur=0.1, gap_dur=0.1, noise=0.05,
+                   seed=0):
+    """Write 16-bit mono wav of harmonic stacks separated by gaps of noise.
+
+    Args:
+        duration (float): length in seconds
+        pitch (float): fundamental frequency of stacks in Hz
+        n_harmonics (int): number of harmonics (including fundamental)
+        stack_dur, gap_dur (float): seconds of each stack and each gap
+        noise (float): noise amplitude relative to stack amplitude
+        seed (int): random seed, so files are repeatable
+    """
+    rng = numpy.random.RandomState(seed)
+    n = int(duration*sample_rate)
+    t = numpy.arange(n)/float(sample_rate)
+    sound = numpy.zeros(n)
+    for h in range(1, n_harmonics+1):
+        if h*pitch < sample_rate/2.0:
+            sound += numpy.sin(2*numpy.pi*h*pitch*t + rng.uniform(0, 2*numpy.pi))/h
+    in_stack = (t % (stack_dur+gap_dur)) < stack_dur
+    sound *= in_stack / numpy.abs(sound).max()
+    sound += noise*rng.standard_normal(n)
+    _write_wav(path, sound/numpy.abs(sound).max(), sample_rate)
+
+def make_tone_wav(path, duration=10.0, sample_rate=44100, freq=1000.0,
+                  sweep=0.0, noise=1e-3, seed=0):
+    """Write 16-bit mono wav of a continuous tone (no gaps).
+
+    Args:
+        freq (float): starting frequency in Hz
+        sweep (float): change of frequency in Hz per second
+        noise (float): noise amplitude relative to tone amplitude
+    """
+    rng = numpy.random.RandomState(seed)
+    t = numpy.arange(int(duration*sample_rate))/float(sample_rate)
+    sound = numpy.sin(2*numpy.pi*(freq + 0.5*sweep*t)*t)
+    sound += noise*rng.standard_normal(len(t))
+    _write_wav(path, sound/numpy.abs(sound).max(), sample_rate)
+
+def make_noise_wav(path, duration=10.0, sample_rate=44100, seed=0):
+    """Write 16-bit mono wav of white noise."""
+    rng = numpy.random.RandomState(seed)
+    sound = rng.standard_normal(int(duration*sample_rate))
+    _write_wav(path, sound/numpy.abs(sound).max(), sample_rate)
+
+def _write_wav(path, sound, sample_rate):
+    """Write sound (floats, -1.0 to 1.0) as 16-bit mono wav."""
+    snd = wave.open(path, 'w')
+    try:
+        snd.setnchannels(1)
+        snd.setsampwidth(2)
+        snd.setframerate(sample_rate)
+        snd.writeframes((sound*32000).astype('<i2').tobytes())
+    finally:
+        snd.close()
+
+def measure(fn, repeat=3):
+    """Run fn() repeat times, then once more to measure memory.
+
+    Returns:
+        dict with best and mean seconds, and peak bytes allocated during a
+        run (None if tracemalloc is not available)
+    """
+    seconds = []
+    for i in range(repeat):
+        start = timeit.default_timer()
+        fn()
+        seconds.append(timeit.default_timer() - start)
+    peak_bytes = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            fn()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'best': min(seconds), 'mean': sum(seconds)/len(seconds),
+            'repeat': repeat, 'peak_bytes': peak_bytes}
+
+def bench_file(path, kind, blocksizes, overlaps, repeat):
+    """Run all benchmarks on one file. Returns list of result dicts."""
+    results = []
+
+    def add(name, fn, **params):
+        params['file'] = kind
+        result = measure(fn, repeat)
+        result.update(name=name, params=params)
+        results.append(result)
+        sys.stdout.write('{:<18} {:<62} {:9.4f}s {:>9}\n'.format(
+            name, json.dumps(params, sort_keys=True), result['best'],
+            '' if result['peak_bytes'] is None else
+            '{:.1f}MB'.format(result['peak_bytes']/1e6)))
+
+    add('load', lambda: signal_lab.SignalLab(path))
+    add('load', lambda: signal_lab.SignalLab(path, mmap=True), mmap=True)
+
+    data = signal_lab.SignalLab(path)
+    n_frames = 100 # per run of single-frame benchmarks
+    offsets = numpy.linspace(0.0, 0.9*data.n_wav_samps*data.delta_t,
+                             n_frames*(repeat+1)*len(blocksizes)*2)
+    offsets = iter(offsets) # new offset every time, so caches don't hide the work
+
+    def power_spectra(blocksize):
+        for i in range(n_frames):
+            data.power_spectrum(next(offsets), blocksize, plot_it=False)
+
+    def cepstra(blocksize):
+        for i in range(n_frames):
+            data.frame_cepstrum(data.frame(next(offsets), blocksize))
+
+    for blocksize in blocksizes:
+        add('power_spectrum', lambda: power_spectra(blocksize),
+            blocksize=blocksize, frames=n_frames)
+        add('cepstrum', lambda: cepstra(blocksize),
+            blocksize=blocksize, frames=n_frames)
+    for blocksize in blocksizes:
+        for overlap in overlaps:
+            add('goodness_of_pitch', lambda: data.goodness_of_pitch(
+                blocksize, overlap, plot_it=False),
+                blocksize=blocksize, overlap=overlap)
+    add('sweep', lambda: data.sweep(blocksizes, overlaps, (.1, .25, .5),
+                                    (2e3, 4.2e3, 8e3)),
+        blocksizes=blocksizes, overlaps=overlaps, thresholds=3,
+        max_pitch_freqs=3)
+    for blocksize in blocksizes:
+        add('spectrogram', lambda: data.spectrogram(blocksize=blocksize,
+                                                    max_freq=10e3),
+            blocksize=blocksize, max_freq=10e3)
+    return results
+
+def compare(results, old_path):
+    """Print ratio of old best time to new best time for matching benchmarks."""
+    with open(old_path) as f:
+        old = json.load(f)
+    old_best = dict(((r['name'], json.dumps(r['params'], sort_keys=True)),
+                     r['best']) for r in old['results'])
+    sys.stdout.write('\nspeedup vs {}\n'.format(old_path))
+    for r in results:
+        key = (r['name'], json.dumps(r['params'], sort_keys=True))
+        if key in old_best and r['best'] > 0:
+            sys.stdout.write('{:<18} {:<62} {:7.2f}x\n'.format(
+                key[0], key[1], old_best[key]/r['best']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark SignalLab.')
+    parser.add_argument('--duration', type=float, default=30.0,
+                        help='seconds of synthetic sound (default %(default)s)')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--pitch', type=float, default=600.0,
+                        help='pitch of harmonic stacks in Hz')
+    parser.add_argument('--files', default='stack,noise',
+                        help='synthetic files to use: stack, noise, or both')
+    parser.add_argument('--blocksizes', default='512,1024,2048')
+    parser.add_argument('--overlaps', default='0,0.5,0.75')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', default='bench_results.json',
+                        help='JSON results file (default %(default)s)')
+    parser.add_argument('--compare', help='earlier JSON results file')
+    args = parser.parse_args(argv)
+
+    blocksizes = [int(b) for b in args.blocksizes.split(',')]
+    overlaps = [float(o) for o in args.overlaps.split(',')]
+    tmp_dir = tempfile.mkdtemp(prefix='siglab_bench')
+    results = []
+    try:
+        for kind in args.files.split(','):
+            path = os.path.join(tmp_dir, kind + '.wav')
+            if kind == 'stack':
+                make_stack_wav(path, args.duration, args.sample_rate, args.pitch)
+            elif kind == 'noise':
+                make_noise_wav(path, args.duration, args.sample_rate)
+            else:
+                parser.error('unknown file kind {}'.format(kind))
+            results += bench_file(path, kind, blocksizes, overlaps, args.repeat)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    run = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+           'python': platform.python_version(),
+           'numpy': numpy.__version__,
+           'platform': platform.platform(),
+           'args': vars(args),
+           'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(run, f, indent=1)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
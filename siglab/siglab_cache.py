@@ -0,0 +1,162 @@
+"""Persistent on-disk cache of SignalLab analysis results.
+
+Results are stored as npz files in a cache directory, keyed by a hash of the
+sound file's contents plus the analysis parameters, so a changed file never
+returns stale results. The content hash of each file is remembered along with
+its size and modification time, and is only recomputed when those change.
+When the cache grows past max_bytes, least recently used entries are deleted.
+
+Example:
+    cache = siglab_cache.AnalysisCache('siglab_cache')
+    data = signal_lab.SignalLab(path, cache=cache)
+    stacks = data.goodness_of_pitch(plot_it=False) # instant 2nd time
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy
+
+def _replace(src, dst):
+    """Atomically rename src to dst, replacing dst if it exists."""
+    try:
+        os.replace(src, dst)
+    except AttributeError: # Python 2 - rename replaces on POSIX
+        os.rename(src, dst)
+
+class AnalysisCache(object):
+    """Directory of cached analysis results.
+
+    Attributes:
+        directory (str): cache directory (created if needed)
+        max_bytes (int): max total size of cached results
+        hits (int): number of load() calls that found a result
+        misses (int): number of load() calls that did not
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = os.path.join(directory, 'entries')
+        self._hashes = os.path.join(directory, 'hashes')
+        for d in (self._entries, self._hashes):
+            if not os.path.isdir(d):
+                os.makedirs(d)
+
+    def _write_atomic(self, path, write):
+        """Call write(file object) on temp file in path's directory, then
+        rename it to path, so readers never see a partly written file.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            _replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def content_hash(self, path):
+        """Return sha1 hex digest of file contents.
+
+        Remembered with the file's size and modification time, so the file
+        is only read again after it changes.
+        """
+        st = os.stat(path)
+        stamp = [st.st_size, repr(st.st_mtime)]
+        memo_path = os.path.join(self._hashes, hashlib.sha1(
+            os.path.abspath(path).encode('utf-8')).hexdigest() + '.json')
+        try:
+            with open(memo_path) as f:
+                memo = json.load(f)
+            if memo['stamp'] == stamp:
+                return memo['sha1']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+        memo = json.dumps({'stamp': stamp, 'sha1': digest}).encode('utf-8')
+        self._write_atomic(memo_path, lambda f: f.write(memo))
+        return digest
+
+    def key(self, path, kind, params):
+        """Return cache key for analysis kind (str) of file with params (dict)."""
+        text = json.dumps([self.content_hash(path), kind, sorted(params.items())])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self._entries, key + '.npz')
+
+    def load(self, key):
+        """Return dict of arrays stored under key, or None if not cached."""
+        entry_path = self._entry_path(key)
+        try:
+            with numpy.load(entry_path) as npz:
+                arrays = dict((name, npz[name]) for name in npz.files)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(entry_path, None) # mark as recently used
+        except OSError:
+            pass
+        self.hits += 1
+        return arrays
+
+    def store(self, key, arrays):
+        """Store dict of arrays under key, then evict if over max_bytes."""
+        self._write_atomic(self._entry_path(key),
+                           lambda f: numpy.savez(f, **arrays))
+        self.evict()
+
+    def get(self, path, kind, params, compute):
+        """Return cached arrays for kind/params of file at path, calling
+        compute() (which returns a dict of arrays) and storing the result if
+        not cached.
+        """
+        key = self.key(path, kind, params)
+        arrays = self.load(key)
+        if arrays is None:
+            arrays = compute()
+            self.store(key, arrays)
+        return arrays
+
+    def size(self):
+        """Return total bytes of cached results."""
+        return sum(os.path.getsize(os.path.join(self._entries, name))
+                   for name in os.listdir(self._entries)
+                   if name.endswith('.npz'))
+
+    def evict(self):
+        """Delete least recently used results until size() <= max_bytes."""
+        entries = []
+        for name in os.listdir(self._entries):
+            if name.endswith('.npz'):
+                try:
+                    st = os.stat(os.path.join(self._entries, name))
+                except OSError: # deleted by another process
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self._entries, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Delete all cached results and remembered content hashes."""
+        for d in (self._entries, self._hashes):
+            for name in os.listdir(d):
+                os.remove(os.path.join(d, name))
@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+
+"""Indexed search for renditions of a motif across a corpus of wav files.
+
+Each file is reduced to a fingerprint: the log power (dB) in n_bands equal
+frequency bands up to max_freq, for each frame of a short-time spectrum
+(see fingerprint()). Fingerprints are stored in an index directory, along
+with a summary vector of every window of window_frames frames - pooled to a
+few time steps, mean removed and normalized, so the dot product of two
+summaries is the correlation of the windows.
+
+A search fingerprints the query clip, finds the nearest summaries to the
+query's windows (a matrix product over the compact summaries, not a rescan
+of audio) and refines each candidate by FFT cross-correlation of the full
+query fingerprint with the candidate's fingerprint. Scores are normalized
+cross-correlations: 1.0 is a perfect match, up to a change of gain.
+
+Index layout:
+    catalog.json        params, and path, stamp, frames of each file
+    fingerprints/       one .npy file (float16, frames by bands) per file
+    summaries.npy       summary vectors of all files, with
+    summary_file.npy    index into catalog files, and
+    summary_frame.npy   first frame, of each
+
+Example:
+    python siglab_search.py index motif_index motifs/ --jobs 8
+    python siglab_search.py search motif_index query.wav
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import traceback
+
+import numpy
+import signal_lab
+import siglab_cache
+
+# One search result - start_time and duration in seconds, score is the
+# normalized cross-correlation of the query and this part of the file.
+Match = collections.namedtuple('Match', 'path start_time duration score')
+
+DEFAULT_PARAMS = {'blocksize': 512, 'hop': 256, 'n_bands': 32,
+                  'max_freq': 10e3, 'dynamic_range_db': 60.0,
+                  'window_frames': 32, 'pool_frames': 8}
+
+def fingerprint(data, sample_rate, blocksize=512, hop=256, n_bands=32,
+                max_freq=10e3, dynamic_range_db=60.0):
+    """Return fingerprint of sound data.
+
+    Args:
+        data (numpy array): 1-D sound data
+        sample_rate (float): sample rate in Hz
+        blocksize (int): FFT blocksize
+        hop (int): samples between frames
+        n_bands (int): number of equal frequency bands from 0 to max_freq
+        dynamic_range_db (float): values more than this below the loudest
+            are raised to it, so quiet noise doesn't count in matches
+
+    Returns:
+        numpy float32 array, frames by bands, of log power in dB
+    """
+    Pxx, freqs, bins = signal_lab.stft_power(data, blocksize, blocksize - hop,
+                                             sample_rate, max_freq)
+    if len(freqs) < n_bands:
+        raise ValueError('{} bands but only {} FFT bins up to {} Hz'.format(
+            n_bands, len(freqs), max_freq))
+    edges = numpy.searchsorted(freqs, numpy.linspace(0.0, freqs[-1], n_bands+1)[:-1])
+    bands = numpy.add.reduceat(Pxx, edges, axis=0) if Pxx.shape[1] else \
+            numpy.zeros((n_bands, 0), Pxx.dtype)
+    fp = (10.0*numpy.log10(bands.T.astype(numpy.float64) + 1e-12))
+    if fp.size:
+        numpy.maximum(fp, fp.max() - dynamic_range_db, out=fp)
+    return fp.astype(numpy.float32)
+
+def summarize(fp, starts, window_frames=32, pool_frames=8):
+    """Return summary vector of each window of fingerprint fp.
+
+    The window_frames frames from each start are averaged in groups of
+    pool_frames, then the mean is removed and the vector normalized, so the
+    dot product of two summaries is their correlation.
+
+    Args:
+        fp (numpy array): fingerprint, frames by bands
+        starts (numpy int array): first frame of each window
+
+    Returns:
+        numpy float32 array, one row per start (none for a file shorter
+        than window_frames)
+    """
+    n_pooled = window_frames // pool_frames
+    if len(starts) == 0:
+        return numpy.zeros((0, fp.shape[1]*n_pooled), numpy.float32)
+    sums = numpy.zeros((len(fp)+1, fp.shape[1]))
+    numpy.cumsum(fp, axis=0, out=sums[1:])
+    edges = numpy.asarray(starts)[:, None] + \
+            pool_frames*numpy.arange(n_pooled+1)[None, :]
+    vectors = numpy.diff(sums[edges], axis=1).reshape(len(starts), -1)
+    vectors -= vectors.mean(axis=1)[:, None]
+    norms = numpy.sqrt((vectors*vectors).sum(axis=1))
+    vectors /= numpy.where(norms > 0, norms, 1.0)[:, None]
+    return vectors.astype(numpy.float32)
+
+def normalized_xcorr(query, target):
+    """Return normalized cross-correlation of fingerprint query (m frames)
+    with each m-frame window of fingerprint target, computed with FFTs.
+
+    Returns:
+        numpy array, len(target) - m + 1 values from -1.0 to 1.0
+    """
+    query = numpy.asarray(query, dtype=numpy.float64)
+    target = numpy.asarray(target, dtype=numpy.float64)
+    m, n = len(query), len(target)
+    if n < m:
+        return numpy.zeros(0)
+    q = query - query.mean()
+    q_norm = numpy.sqrt((q*q).sum())
+    size = 1 << int(n - 1).bit_length() # no wrap-around for lags 0 to n-m
+    spectrum = numpy.fft.rfft(target, size, axis=0) * \
+               numpy.conj(numpy.fft.rfft(q, size, axis=0))
+    corr = numpy.fft.irfft(spectrum.sum(axis=1), size)[:n-m+1]
+    # q has zero mean, so corr is also q against each window minus its mean
+    row_sums = numpy.concatenate(([0.0], target.sum(axis=1).cumsum()))
+    row_squares = numpy.concatenate(([0.0], (target*target).sum(axis=1).cumsum()))
+    sums = row_sums[m:] - row_sums[:-m]
+    variances = row_squares[m:] - row_squares[:-m] - sums*sums/query.size
+    norms = q_norm*numpy.sqrt(numpy.maximum(variances, 0.0))
+    return numpy.where(norms > 1e-9, corr/numpy.where(norms > 1e-9, norms, 1.0), 0.0)
+
+def _fingerprint_file(args):
+    """Fingerprint one file. Runs in a worker process.
+
+    Args:
+        args (tuple): (path, params) - params as in FingerprintIndex
+
+    Returns:
+        dict with path, stamp, sample_rate and fp, or path and error
+    """
+    path, params = args
+    try:
+        st = os.stat(path)
+        data = signal_lab.SignalLab(path, mmap=True, compact=True)
+        fp = fingerprint(data.sound_data, data.sample_rate, params['blocksize'],
+                         params['hop'], params['n_bands'], params['max_freq'],
+                         params['dynamic_range_db'])
+        return {'path': path, 'stamp': [st.st_size, repr(st.st_mtime)],
+                'sample_rate': data.sample_rate, 'fp': fp}
+    except Exception as e:
+        return {'path': path, 'error': '{}: {}'.format(type(e).__name__, e),
+                'traceback': traceback.format_exc()}
+
+class FingerprintIndex(object):
+    """Directory of fingerprints of wav files, searchable by query clip.
+
+    All files must have the same sample rate (that of the first file added),
+    so frames of every file span the same time.
+
+    Attributes:
+        directory (str): index directory (created if needed)
+        params (dict): fingerprint and summary params - see DEFAULT_PARAMS
+            and fingerprint(); params of an existing index are kept
+        files (list): dict with path, stamp, n_frames, id for each file
+        sample_rate (float): sample rate of all files, None if none yet
+    """
+
+    def __init__(self, directory, **params):
+        self.directory = directory
+        self._fingerprints = os.path.join(directory, 'fingerprints')
+        if not os.path.isdir(self._fingerprints):
+            os.makedirs(self._fingerprints)
+        self._summaries = None # (vectors, file, frame), loaded when needed
+        catalog_path = os.path.join(directory, 'catalog.json')
+        if os.path.exists(catalog_path):
+            with open(catalog_path) as f:
+                catalog = json.load(f)
+            self.params = catalog['params']
+            self.sample_rate = catalog['sample_rate']
+            self.files = catalog['files']
+        else:
+            self.params = dict(DEFAULT_PARAMS)
+            self.params.update(params)
+            self.sample_rate = None
+            self.files = []
+        self._by_path = dict((entry['path'], i) for i, entry in enumerate(self.files))
+
+    def _write_atomic(self, name, write):
+        """Call write(file object) on temp file, then rename it to name in
+        the index directory."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            siglab_cache._replace(tmp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _fingerprint_path(self, entry):
+        return os.path.join(self._fingerprints, entry['id'] + '.npy')
+
+    def load_fingerprint(self, i):
+        """Return fingerprint of files[i] (memory-mapped)."""
+        return numpy.load(self._fingerprint_path(self.files[i]), mmap_mode='r')
+
+    def _add_result(self, result):
+        """Store one result of _fingerprint_file()."""
+        if self.sample_rate is None:
+            self.sample_rate = result['sample_rate']
+        elif result['sample_rate'] != self.sample_rate:
+            raise ValueError('{} sample rate is {}, index is {}'.format(
+                result['path'], result['sample_rate'], self.sample_rate))
+        entry = {'path': result['path'], 'stamp': result['stamp'],
+                 'n_frames': len(result['fp']),
+                 'id': hashlib.sha1(os.path.abspath(result['path']).encode(
+                     'utf-8')).hexdigest()}
+        fp = result['fp'].astype(numpy.float16)
+        self._write_atomic(os.path.join('fingerprints', entry['id'] + '.npy'),
+                           lambda f: numpy.save(f, fp))
+        if entry['path'] in self._by_path:
+            self.files[self._by_path[entry['path']]] = entry
+        else:
+            self._by_path[entry['path']] = len(self.files)
+            self.files.append(entry)
+        self._summaries = None
+
+    def _is_current(self, path):
+        """True if path is indexed and hasn't changed since."""
+        i = self._by_path.get(path)
+        if i is None:
+            return False
+        st = os.stat(path)
+        return self.files[i]['stamp'] == [st.st_size, repr(st.st_mtime)]
+
+    def add(self, paths, jobs=None, progress=False):
+        """Fingerprint files not yet indexed (or changed since), then save().
+
+        Args:
+            paths (list of str): wav files
+            jobs (int): number of worker processes, default is number of
+                CPUs; 1 to fingerprint in this process
+            progress (bool): if True, write a line per file to stderr
+
+        Returns:
+            list of (path, error message) of files that could not be added
+        """
+        tasks = [(path, self.params) for path in paths if not self._is_current(path)]
+        if jobs == 1:
+            results = (_fingerprint_file(task) for task in tasks)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(jobs)
+            results = pool.imap_unordered(_fingerprint_file, tasks, chunksize=4)
+        errors = []
+        try:
+            for n_done, result in enumerate(results, 1):
+                if 'error' not in result:
+                    try:
+                        self._add_result(result)
+                    except ValueError as e:
+                        result['error'] = 'ValueError: {}'.format(e)
+                if 'error' in result:
+                    errors.append((result['path'], result['error']))
+                if progress:
+                    sys.stderr.write('[{}/{}] {} {}\n'.format(
+                        n_done, len(tasks), result['path'],
+                        'ERROR ' + result['error'] if 'error' in result else
+                        '{} frames'.format(len(result['fp']))))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        self.save()
+        return errors
+
+    def save(self):
+        """Write catalog and rebuild summaries of all files."""
+        window, pool = self.params['window_frames'], self.params['pool_frames']
+        vectors, files, frames = [], [], []
+        for i in range(len(self.files)):
+            fp = self.load_fingerprint(i)
+            starts = numpy.arange(0, len(fp) - window + 1, pool)
+            vectors.append(summarize(fp, starts, window, pool))
+            files.append(numpy.full(len(starts), i, numpy.int32))
+            frames.append(starts.astype(numpy.int32))
+        dim = self.params['n_bands']*(window // pool)
+        summaries = (numpy.concatenate(vectors) if vectors else
+                     numpy.zeros((0, dim), numpy.float32),
+                     numpy.concatenate(files) if files else numpy.zeros(0, numpy.int32),
+                     numpy.concatenate(frames) if frames else numpy.zeros(0, numpy.int32))
+        for name, array in zip(('summaries.npy', 'summary_file.npy',
+                                'summary_frame.npy'), summaries):
+            self._write_atomic(name, lambda f: numpy.save(f, array))
+        catalog = json.dumps({'params': self.params, 'sample_rate': self.sample_rate,
+                              'files': self.files}, indent=1).encode('utf-8')
+        self._write_atomic('catalog.json', lambda f: f.write(catalog))
+        self._summaries = summaries
+
+    def summaries(self):
+        """Return (vectors, file index, first frame) of all summaries."""
+        if self._summaries is None:
+            self._summaries = tuple(
+                numpy.load(os.path.join(self.directory, name), mmap_mode='r')
+                for name in ('summaries.npy', 'summary_file.npy',
+                             'summary_frame.npy'))
+        return self._summaries
+
+    def query_fingerprint(self, path, offset_time=0.0, duration=None):
+        """Return fingerprint of duration seconds of wav file at path."""
+        data = signal_lab.SignalLab(path, mmap=True, compact=True)
+        if self.sample_rate is not None and data.sample_rate != self.sample_rate:
+            raise ValueError('{} sample rate is {}, index is {}'.format(
+                path, data.sample_rate, self.sample_rate))
+        offset_i = int(0.5 + offset_time*data.sample_rate)
+        stop_i = data.n_wav_samps if duration is None else \
+                 offset_i + int(0.5 + duration*data.sample_rate)
+        p = self.params
+        return fingerprint(data.sound_data[offset_i:stop_i], data.sample_rate,
+                           p['blocksize'], p['hop'], p['n_bands'], p['max_freq'],
+                           p['dynamic_range_db'])
+
+    def _candidates(self, query, neighbors, n_candidates, chunk_size=1 << 16):
+        """Return [(file index, first frame)] of likely matches of query
+        fingerprint, from nearest summaries of the query's windows."""
+        window, pool = self.params['window_frames'], self.params['pool_frames']
+        n_starts = len(query) - window + 1
+        # every offset within a pool step, so one lines up with the index's
+        # windows, plus windows spread over the rest of the query
+        starts = numpy.union1d(numpy.arange(min(pool, n_starts)),
+                               numpy.linspace(0, n_starts-1, 32).astype(int))
+        query_vectors = summarize(query, starts, window, pool)
+        vectors, files, frames = self.summaries()
+        best = {} # (file, frame rounded to pool) -> (score, frame)
+        for lo in range(0, len(vectors), chunk_size):
+            scores = numpy.dot(query_vectors, numpy.asarray(vectors[lo:lo+chunk_size]).T)
+            k = min(neighbors, scores.shape[1])
+            nearest = numpy.argpartition(-scores, k-1, axis=1)[:, :k]
+            for qi, row in zip(numpy.repeat(numpy.arange(len(starts)), k),
+                               nearest.ravel()):
+                score = scores[qi, row]
+                frame = int(frames[lo+row]) - int(starts[qi])
+                key = (int(files[lo+row]), int(round(float(frame)/pool)))
+                if key not in best or score > best[key][0]:
+                    best[key] = (score, frame)
+        ranked = sorted(best.items(), key=lambda item: -item[1][0])[:n_candidates]
+        return [(file_i, frame) for (file_i, rounded), (score, frame) in ranked]
+
+    def search(self, path, offset_time=0.0, duration=None, max_results=20,
+               min_score=0.6, neighbors=20, n_candidates=100, exhaustive=False):
+        """Find parts of indexed files similar to a query clip.
+
+        Args:
+            path (str): wav file of query
+            offset_time, duration (float): part of query file to use, in
+                seconds - default is all of it
+            max_results (int): max number of matches returned
+            min_score (float): lowest normalized cross-correlation returned
+            neighbors (int): nearest summaries kept per query window
+            n_candidates (int): candidates refined by cross-correlation
+            exhaustive (bool): if True, skip the summaries and cross-correlate
+                the query with every file - slow, for checking results
+
+        Returns:
+            list of Match, best first; matches in a file overlap by no more
+            than half the query
+        """
+        query = self.query_fingerprint(path, offset_time, duration)
+        window = self.params['window_frames']
+        if len(query) < window:
+            raise ValueError('query is {} frames, must be at least {}'.format(
+                len(query), window))
+        m = len(query)
+        if exhaustive:
+            regions = [(i, 0, entry['n_frames']) for i, entry in enumerate(self.files)]
+        else:
+            margin = self.params['pool_frames']
+            regions = [(i, max(0, frame - margin), frame + m + margin)
+                       for i, frame in self._candidates(query, neighbors, n_candidates)]
+        frame_time = self.params['hop']/float(self.sample_rate)
+        duration = ((m-1)*self.params['hop'] + self.params['blocksize']) / \
+                   float(self.sample_rate)
+        matches = []
+        for i, lo, hi in regions:
+            scores = normalized_xcorr(query, self.load_fingerprint(i)[lo:hi])
+            if exhaustive:
+                # local maxima only - one match per peak
+                peaks = numpy.flatnonzero(
+                    (scores >= min_score) &
+                    (scores >= numpy.append(scores[1:], -numpy.inf)) &
+                    (scores > numpy.insert(scores[:-1], 0, -numpy.inf)))
+            else:
+                peaks = [int(scores.argmax())] if len(scores) else []
+            for peak in peaks:
+                matches.append(Match(self.files[i]['path'],
+                                     float((lo + peak)*frame_time), duration,
+                                     float(scores[peak])))
+
+        results = []
+        for match in sorted(matches, key=lambda match: -match.score):
+            if match.score < min_score or len(results) == max_results:
+                break
+            if not any(r.path == match.path and
+                       abs(r.start_time - match.start_time) < 0.5*match.duration
+                       for r in results):
+                results.append(match)
+        return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Index wav files and search them for a motif.')
+    commands = parser.add_subparsers(dest='command')
+    index = commands.add_parser('index', help='add wav files to index')
+    index.add_argument('index', help='index directory')
+    index.add_argument('top', help='directory to search for wav files')
+    index.add_argument('--pattern', default='*_motif_*.wav',
+                       help='file name pattern (default %(default)s)')
+    index.add_argument('--jobs', type=int, default=None,
+                       help='worker processes (default: number of CPUs)')
+    search = commands.add_parser('search', help='find matches of query clip')
+    search.add_argument('index', help='index directory')
+    search.add_argument('query', help='wav file of query')
+    search.add_argument('--offset', type=float, default=0.0,
+                        help='start of query in file, seconds')
+    search.add_argument('--duration', type=float, default=None,
+                        help='length of query, seconds (default: to end)')
+    search.add_argument('--max-results', type=int, default=20)
+    search.add_argument('--min-score', type=float, default=0.6)
+    search.add_argument('--exhaustive', action='store_true',
+                        help='cross-correlate with every file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'index':
+        import siglab_batch
+        fingerprints = FingerprintIndex(args.index)
+        errors = fingerprints.add(siglab_batch.find_files(args.top, args.pattern),
+                                  args.jobs, progress=True)
+        sys.stderr.write('{} files indexed, {} errors\n'.format(
+            len(fingerprints.files), len(errors)))
+        return 1 if errors else 0
+    elif args.command == 'search':
+        fingerprints = FingerprintIndex(args.index)
+        for match in fingerprints.search(args.query, args.offset, args.duration,
+                                         args.max_results, args.min_score,
+                                         exhaustive=args.exhaustive):
+            sys.stdout.write('{:.3f} {:9.3f} {:7.3f} {}\n'.format(
+                match.score, match.start_time, match.duration, match.path))
+        return 0
+    parser.print_help()
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main())
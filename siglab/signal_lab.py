@@ -8,25 +8,43 @@ Written Feb 2016 by Brandon Warren (bwarren@uw.edu)
 
 """
 
+import os
+import copy
 import wave
+import json
+import struct
+import collections
+import threading
+import timeit
+import multiprocessing
+import multiprocessing.pool
 import numpy
-import matplotlib.pyplot as plt
-from matplotlib import mlab
-from pylab import gca
+from numpy.lib.stride_tricks import as_strided
+try:
+    from matplotlib import mlab
+except ImportError: # only needed by specgram_freq_limit() and plotting
+    mlab = None
 
-def specgram_freq_limit(x, NFFT=256, Fs=2, Fc=0, detrend=mlab.detrend_none,
-             window=mlab.window_hanning, noverlap=128,
+def specgram_freq_limit(x, NFFT=256, Fs=2, Fc=0, detrend=None,
+             window=None, noverlap=128,
              cmap=None, xextent=None, pad_to=None, sides='default',
              scale_by_freq=None, minfreq=0.0, maxfreq=None, ax=None, **kwargs):
     """Wrapper for matplotlib.pyplot.specgram to remove frequencies not of
     interest. You can call set_ylim([0.0, max_freq]), but the colors will
     remain unchanged. This will cause the full range of color to appear.
 
+    detrend defaults to mlab.detrend_none, window to mlab.window_hanning.
+    SignalLab.plot_spectrogram() uses stft_power() instead.
+
     From http://stackoverflow.com/questions/19468923/cutting-of-unused-frequencies-in-specgram-matplotlib
     """
 
+    if detrend is None:
+        detrend = mlab.detrend_none
+    if window is None:
+        window = mlab.window_hanning
     if ax is None:
-        ax = gca()
+        ax = _pyplot().gca()
     Pxx, freqs, bins = mlab.specgram(x, NFFT=NFFT, Fs=Fs, detrend=detrend,
          window=window, noverlap=noverlap, pad_to=pad_to, sides=sides,
         scale_by_freq=scale_by_freq, **kwargs)
@@ -50,94 +68,1140 @@ def specgram_freq_limit(x, NFFT=256, Fs=2, Fc=0, detrend=mlab.detrend_none,
 
     return Pxx, freqs, bins, im
 
+def _pyplot():
+    """Import pyplot when first needed, so analysis without plotting never
+    loads a GUI backend (see siglab_batch.py).
+    """
+    import matplotlib.pyplot as plt
+    return plt
+
+class _StageTimer(object):
+    """Context manager that times one stage for Instrumentation."""
+
+    def __init__(self, instrumentation, stage, items):
+        self._instrumentation = instrumentation
+        self._stage = stage
+        self._items = items
+
+    def __enter__(self):
+        self._start = timeit.default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._instrumentation.record(self._stage,
+                                     timeit.default_timer() - self._start,
+                                     self._items)
+
+class _NullTimer(object):
+    """Context manager that does nothing - used when not instrumenting."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+class Instrumentation(object):
+    """Counters and timers for the stages of SignalLab analysis.
+
+    Stages are decode, decimation, gating, framing, windowing, fft,
+    cepstrum, entropy, features (other song features), stacks and plotting.
+    Batched stages are timed once per batch, with items set to the number of
+    frames (samples for decode and decimation).
+
+    Example:
+        inst = Instrumentation()
+        data = SignalLab(path, instrumentation=inst)
+        data.goodness_of_pitch(plot_it=False)
+        print(inst.stats())
+
+    Attributes:
+        callback: if not None, called as callback(stage, seconds, items)
+            after each timed stage
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._lock = threading.Lock() # stages may be timed in worker threads
+        self.reset()
+
+    def reset(self):
+        """Zero all counters and timers."""
+        self._calls = collections.defaultdict(int)
+        self._seconds = collections.defaultdict(float)
+        self._items = collections.defaultdict(int)
+
+    def stage(self, stage, items=1):
+        """Return context manager that times the code it wraps as stage."""
+        return _StageTimer(self, stage, items)
+
+    def record(self, stage, seconds, items=1):
+        """Add a timed run of stage."""
+        with self._lock:
+            self._calls[stage] += 1
+            self._seconds[stage] += seconds
+            self._items[stage] += items
+        if self.callback is not None:
+            self.callback(stage, seconds, items)
+
+    def stats(self):
+        """Return dict of stage: {'calls', 'seconds', 'items'}."""
+        return dict((stage, {'calls': self._calls[stage],
+                             'seconds': self._seconds[stage],
+                             'items': self._items[stage]})
+                    for stage in self._calls)
+
+class _NoInstrumentation(Instrumentation):
+    """Instrumentation that records nothing, at close to no cost."""
+
+    _timer = _NullTimer()
+
+    def stage(self, stage, items=1):
+        return self._timer
+
+    def record(self, stage, seconds, items=1):
+        pass
+
+_NO_INSTRUMENTATION = _NoInstrumentation()
+
+class _WorkBuffers(object):
+    """Preallocated arrays reused from one frame (or batch) to the next.
+
+    Not thread-safe - each thread needs its own.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype):
+        """Return uninitialized array for name. Reuses the last one if big
+        enough and of the same dtype.
+        """
+        size = int(numpy.prod(shape))
+        buf = self._buffers.get(name)
+        if buf is None or buf.dtype != dtype or buf.size < size:
+            buf = self._buffers[name] = numpy.empty(size, dtype)
+        return buf[:size].reshape(shape)
+
+def hann_window(blocksize, dtype=numpy.float64):
+    """Return a Hann window of length blocksize."""
+    d = 2.0 * numpy.pi / (blocksize-1)
+    return (0.5 * (1.0 - numpy.cos(d * numpy.arange(blocksize)))).astype(dtype)
+
+def frame_view(data, starts, blocksize):
+    """Return 2-D array whose rows are data[s:s+blocksize] for each s in starts.
+
+    If starts are evenly spaced (the usual case) the result is a read-only
+    strided view into data - nothing is copied. Otherwise the rows are
+    gathered from a strided view of every possible frame.
+
+    Args:
+        data (numpy array): 1-D sound data, or 2-D samples by channels (e.g.
+            SignalLab.channel_data), which gives a 3-D array of channels by
+            frames by blocksize
+        starts (numpy int array): 0-based index of first sample of each frame
+        blocksize (int): samples per frame
+    """
+    starts = numpy.asarray(starts)
+    if not isinstance(data, numpy.ndarray) and len(starts):
+        # e.g. Int24Samples - convert only the samples the frames span
+        first = starts.min()
+        data = data[first:starts.max()+blocksize]
+        starts = starts - first
+    data = numpy.asarray(data)
+    step = data.strides[0]
+    # channels (if any) first, then frames, then samples
+    channels = ((data.shape[1],), (data.strides[1],)) if data.ndim == 2 else ((), ())
+    hops = numpy.diff(starts)
+    if len(starts) and (hops == (hops[0] if len(hops) else 0)).all():
+        hop = hops[0] if len(hops) else 0
+        return as_strided(data[starts[0]:],
+                          shape=channels[0] + (len(starts), blocksize),
+                          strides=channels[1] + (hop*step, step), writeable=False)
+    every_frame = as_strided(data, shape=channels[0] + (len(data)-blocksize+1, blocksize),
+                             strides=channels[1] + (step, step), writeable=False)
+    return every_frame[..., starts, :]
+
+def stft_power(data, blocksize, noverlap, sample_rate, max_freq=None,
+               dtype=numpy.float32, frames_per_batch=2048, instrumentation=None,
+               start=0, stop=None):
+    """Power spectrogram of data, limited to frequencies up to max_freq.
+
+    Same result as mlab.specgram() with its defaults (Hann window
+    numpy.hanning, no detrend, one-sided power spectral density) but
+    computed in dtype, frames_per_batch frames at a time, from strided views
+    of data. Only the bins up to max_freq are kept, so the output (and peak
+    memory) shrinks with the band of interest. Matplotlib is not needed.
+
+    Args:
+        data (numpy array): 1-D sound data, or 2-D samples by channels - all
+            channels of a batch of frames go through one FFT call
+        blocksize (int): FFT blocksize
+        noverlap (int): samples of overlap between frames
+        sample_rate (float): sample rate in Hz
+        max_freq (float): highest frequency to keep, None for all
+        instrumentation (Instrumentation): times framing, windowing and fft
+        start, stop (int): analyze data[start:stop], without slicing data
+            first - each batch of frames is a view of (or, for
+            Int24Samples, converted from) just the samples it spans
+
+    Returns:
+        (Pxx, freqs, bins) - power (freq by time, or channel by freq by time
+        for 2-D data), frequency of each row in Hz, center time of each
+        column in seconds (from start)
+    """
+    inst = instrumentation or _NO_INSTRUMENTATION
+    step = blocksize - noverlap
+    stop = len(data) if stop is None else min(stop, len(data))
+    n_frames = max(0, (stop - start - blocksize)//step + 1)
+    freqs = numpy.fft.rfftfreq(blocksize, 1.0/sample_rate)
+    n_keep = len(freqs) if max_freq is None else \
+             int(numpy.searchsorted(freqs, max_freq, side='right'))
+    freqs = freqs[:n_keep]
+
+    window = numpy.hanning(blocksize).astype(dtype)
+    # one-sided density - double all but DC (and Nyquist, if blocksize is even)
+    scale = numpy.full(n_keep, 2.0)
+    scale[0] = 1.0
+    if blocksize % 2 == 0 and n_keep == blocksize//2 + 1:
+        scale[-1] = 1.0
+    scale = (scale / (sample_rate * (window.astype(numpy.float64)**2).sum())).astype(dtype)
+
+    Pxx = numpy.empty(data.shape[1:] + (n_keep, n_frames), dtype=dtype)
+    starts = numpy.arange(n_frames) * step
+    for lo in range(0, n_frames, frames_per_batch):
+        hi = min(lo + frames_per_batch, n_frames)
+        with inst.stage('framing', hi-lo):
+            frames = frame_view(data, start + starts[lo:hi], blocksize).astype(dtype)
+        with inst.stage('windowing', hi-lo):
+            frames *= window
+        with inst.stage('fft', hi-lo):
+            spectrum = numpy.fft.rfft(frames, axis=-1)[..., :n_keep]
+            power = spectrum.real**2
+            power += spectrum.imag**2
+            power *= scale
+            Pxx[..., lo:hi] = numpy.swapaxes(power, -1, -2)
+    bins = (starts + blocksize/2.0) / sample_rate
+    return Pxx, freqs, bins
+
+def decimation_filter(factor, taps_per_factor=64):
+    """Return anti-aliasing low-pass filter for decimation by factor.
+
+    A Hann-windowed sinc with taps_per_factor*factor + 1 taps, cut off at
+    the Nyquist frequency of the decimated signal. With the default length
+    it is flat (within 0.05 dB) up to 0.475 of the decimated sample rate,
+    and anything that aliases into that band is at least 40 dB down.
+    """
+    n_taps = taps_per_factor*factor + 1
+    k = numpy.arange(n_taps) - n_taps//2
+    h = numpy.sinc(k/float(factor)) * numpy.hanning(n_taps+2)[1:-1]
+    return h / h.sum()
+
+def decimate(data, factor, taps_per_factor=64, chunk_size=1 << 18,
+             dtype=numpy.float32):
+    """Low-pass filter data (see decimation_filter()) and keep every
+    factor'th sample.
+
+    Polyphase: the filter is split into its factor phases, each convolved
+    with the matching phase of data at the decimated rate, so no filter
+    output is computed only to be thrown away. The filter is centered, so
+    sample n of the result is at the time of sample n*factor of data. data
+    is read chunk_size output samples' worth at a time, so it works well
+    with memory-mapped data.
+
+    Returns:
+        numpy array of dtype, ceil(len(data)/factor) samples
+    """
+    h = decimation_filter(factor, taps_per_factor)
+    half = len(h)//2
+    phases = [h[p::factor] for p in range(factor)]
+    lead = len(phases[0]) # outputs before lo that a chunk's phases reach back
+    n_out = -(-len(data)//factor)
+    out = numpy.empty(n_out, dtype)
+    for lo in range(0, n_out, chunk_size):
+        hi = min(lo + chunk_size, n_out)
+        # segment[t] is data[first + t], zero outside data
+        first = (lo - lead)*factor
+        segment = numpy.zeros((hi - lo + lead)*factor + half + 1)
+        a, b = max(first, 0), min(first + len(segment), len(data))
+        if a < b:
+            segment[a-first:b-first] = data[a:b]
+        y = numpy.zeros(hi - lo)
+        for p, phase in enumerate(phases):
+            # output n of the chunk needs segment[(n+lead-j)*factor + half - p]
+            # for tap j of the phase
+            x = segment[half-p::factor][:hi - lo + lead]
+            y += numpy.convolve(x, phase)[lead:lead + hi - lo]
+        out[lo:hi] = y
+    return out
+
+# features computed by SignalLab.song_features()
+SONG_FEATURES = ('pitch', 'goodness', 'entropy', 'mean_freq', 'fm', 'amplitude')
+
+def _frame_features(frames, window, n_skip, num_points, sample_rate,
+                    features=SONG_FEATURES, inst=_NO_INSTRUMENTATION,
+                    prev_log_power=None, work=None):
+    """Compute song features of every row of frames in a single pass.
+
+    frames may also be 3-D, channels by frames by blocksize (see
+    frame_view()), in which case every channel goes through the same FFT
+    calls and each feature is channels by frames.
+
+    One windowed real FFT is done per frame, and its power and log power are
+    shared by all the features. pitch, goodness and entropy are the batched
+    equivalent of power_spectrum() + cepstrum() + the entropy calc in
+    goodness_of_pitch(); the means are weighted so they match the means over
+    the full (two-sided) power spectrum. See SignalLab.song_features() for
+    the other features.
+
+    The analysis is done in the dtype of window (float32 or float64), in
+    arrays from work that are reused from one batch to the next.
+
+    Args:
+        n_skip (int or sequence of int): cepstrum points to skip when
+            searching for pitch; if a sequence, pitch and goodness have one
+            row per n_skip (the cepstrum is computed once)
+        features (sequence of str): names from SONG_FEATURES
+        prev_log_power (numpy array): log power spectrum of the frame before
+            the first row (one per channel for 3-D frames), for fm; None if
+            there is none
+        work (_WorkBuffers): buffers to use, None for new ones
+
+    Returns:
+        (dict of feature name: numpy array with one value per frame,
+         log power spectrum of last frame - pass as prev_log_power for the
+         next batch)
+    """
+    unknown = set(features) - set(SONG_FEATURES)
+    if unknown:
+        raise ValueError('Unknown features: {}'.format(', '.join(sorted(unknown))))
+    blocksize = frames.shape[-1]
+    n_frames = frames.size // blocksize if blocksize else 0
+    dtype = window.dtype
+    if work is None:
+        work = _WorkBuffers()
+    values = {}
+    with inst.stage('windowing', n_frames):
+        windowed = numpy.multiply(frames, window,
+                                  out=work.get('windowed', frames.shape, dtype))
+    with inst.stage('fft', n_frames):
+        spectrum = numpy.fft.rfft(windowed, axis=-1)
+        power = numpy.square(spectrum.real,
+                             out=work.get('power', spectrum.shape, dtype))
+        power += numpy.square(spectrum.imag,
+                              out=work.get('imag2', spectrum.shape, dtype))
+    log_power = numpy.log(power, out=work.get('log_power', power.shape, dtype))
+
+    if 'pitch' in features or 'goodness' in features:
+        with inst.stage('cepstrum', n_frames):
+            cepstrum_ = numpy.fft.irfft(log_power, n=blocksize, axis=-1)
+            cepstrum_ = numpy.abs(cepstrum_, out=cepstrum_)
+            indx_max = numpy.array([n + cepstrum_[..., n:num_points].argmax(axis=-1)
+                                    for n in numpy.ravel(n_skip)])
+            goodness = numpy.take_along_axis(cepstrum_[numpy.newaxis],
+                                             indx_max[..., numpy.newaxis],
+                                             axis=-1)[..., 0]
+            if numpy.ndim(n_skip) == 0:
+                indx_max, goodness = indx_max[0], goodness[0]
+            values['goodness'] = goodness
+            values['pitch'] = sample_rate/indx_max
+
+    with inst.stage('entropy', n_frames):
+        # each bin except DC (and Nyquist, if blocksize is even) appears twice
+        # in the two-sided spectrum
+        weights = numpy.full(power.shape[-1], 2.0, dtype=dtype)
+        weights[0] = 1.0
+        if blocksize % 2 == 0:
+            weights[-1] = 1.0
+        # row sums rather than dot(), whose rounding depends on the number
+        # of rows - results must not depend on how frames are batched
+        weighted = work.get('weighted', power.shape, dtype)
+        am = numpy.multiply(power, weights, out=weighted).sum(axis=-1) / blocksize
+        if 'entropy' in features:
+            gm = numpy.exp(numpy.multiply(log_power, weights, out=weighted).sum(
+                axis=-1) / blocksize)
+            values['entropy'] = gm/am
+
+    with inst.stage('features', n_frames):
+        if 'amplitude' in features:
+            values['amplitude'] = 10.0*numpy.log10(am)
+        if 'mean_freq' in features:
+            freqs = numpy.fft.rfftfreq(blocksize, 1.0/sample_rate).astype(dtype)
+            values['mean_freq'] = numpy.multiply(
+                power, weights*freqs, out=weighted).sum(axis=-1) / (am*blocksize)
+        if 'fm' in features:
+            # angle of the spectral change between frames against the
+            # change across frequency, each averaged weighted by power so
+            # the noise floor doesn't count: 0 degrees for a steady tone,
+            # toward 90 degrees as the spectrum sweeps
+            if prev_log_power is None:
+                prev_log_power = numpy.full(log_power.shape[:-2] + log_power.shape[-1:],
+                                            numpy.nan, dtype=log_power.dtype)
+            d_time = numpy.abs(numpy.diff(numpy.concatenate(
+                (prev_log_power[..., numpy.newaxis, :], log_power), axis=-2),
+                axis=-2))
+            d_time = (d_time*power).sum(axis=-1) / power.sum(axis=-1)
+            pair_power = power[..., :-1] + power[..., 1:]
+            d_freq = (numpy.abs(numpy.diff(log_power, axis=-1))*pair_power).sum(
+                axis=-1) / pair_power.sum(axis=-1)
+            values['fm'] = numpy.degrees(numpy.arctan2(d_time, d_freq))
+    return (dict((name, values[name]) for name in features),
+            log_power[..., -1, :].copy())
+
+def frame_rms(data, starts, blocksize, frames_per_batch=2048):
+    """Return RMS of each frame of data - cheap, no FFTs.
+
+    Computed from a running sum of squares over the samples of each batch
+    of frames, so overlapping frames don't square their samples again.
+
+    Args:
+        data (numpy array): 1-D sound data
+        starts (numpy int array): 0-based index of first sample of each frame
+        blocksize (int): samples per frame
+    """
+    rms = numpy.empty(len(starts))
+    for lo in range(0, len(starts), frames_per_batch):
+        hi = min(lo + frames_per_batch, len(starts))
+        first = starts[lo]
+        span = numpy.asarray(data[first:starts[hi-1]+blocksize], dtype=numpy.float64)
+        sums = numpy.concatenate(([0.0], numpy.cumsum(span*span)))
+        rel = starts[lo:hi] - first
+        rms[lo:hi] = numpy.sqrt(numpy.maximum(
+            sums[rel+blocksize] - sums[rel], 0.0) / blocksize)
+    return rms
+
+def _features_at(data, starts, blocksize, window, n_skip, sample_rate, features,
+                 frames_per_batch, inst=_NO_INSTRUMENTATION, prev_start=None,
+                 active=None):
+    """Compute features (see _frame_features()) of the frames at starts.
+
+    Args:
+        prev_start (int): start of the frame before starts[0], used for fm
+            when starts are one segment of a longer run; None if none (or
+            if that frame is not active)
+        active (numpy bool array): if given, only frames where True are
+            analyzed; the others get NaN
+
+    Returns:
+        dict of feature name: numpy array with one value per frame (channels
+        by frames for 2-D data)
+    """
+    shape = data.shape[1:] + (len(starts),)
+    if active is not None:
+        values = dict((name, numpy.full(shape, numpy.nan, window.dtype))
+                      for name in features)
+        active_values = _features_at(data, starts[active], blocksize, window,
+                                     n_skip, sample_rate, features,
+                                     frames_per_batch, inst, prev_start)
+        for name in features:
+            values[name][..., active] = active_values[name]
+        if 'fm' in features and len(starts):
+            # fm needs the frame just before - none after an inactive frame
+            after_inactive = numpy.concatenate(([prev_start is None],
+                                                ~active[:-1]))
+            values['fm'][..., after_inactive] = numpy.nan
+        return values
+
+    values = dict((name, numpy.empty(shape, window.dtype)) for name in features)
+    work = _WorkBuffers() # reused by every batch
+    prev_log_power = None
+    if prev_start is not None and 'fm' in features:
+        prev_frame = frame_view(data, [prev_start], blocksize)
+        _, prev_log_power = _frame_features(prev_frame, window, n_skip,
+                                            blocksize//2, sample_rate, (),
+                                            work=work)
+    for lo in range(0, len(starts), frames_per_batch):
+        hi = min(lo + frames_per_batch, len(starts))
+        with inst.stage('framing', hi-lo):
+            frames = frame_view(data, starts[lo:hi], blocksize)
+        batch_values, prev_log_power = _frame_features(
+            frames, window, n_skip, blocksize//2, sample_rate, features, inst,
+            prev_log_power, work)
+        for name in features:
+            values[name][..., lo:hi] = batch_values[name]
+    return values
+
+_process_signal_labs = {} # SignalLab of each path, in a worker process
+
+def _process_features_at(args):
+    """_features_at() in a worker process, on a memory-mapped SignalLab."""
+    (path, compact, channel_index, decimation, all_channels, starts, blocksize,
+     n_skip, features, prev_start, active) = args
+    key = (path, compact, channel_index, decimation)
+    data = _process_signal_labs.get(key)
+    if data is None:
+        data = _process_signal_labs[key] = SignalLab(
+            path, mmap=True, compact=compact).channel(channel_index).decimated(
+                decimation)
+    return _features_at(data.channel_data if all_channels else data.sound_data,
+                        starts, blocksize, data._window(blocksize), n_skip,
+                        data.sample_rate, features,
+                        data._frames_per_batch(all_channels),
+                        prev_start=prev_start, active=active)
+
+class LRUCache(object):
+    """Bounded least-recently-used cache that counts hits and misses.
+
+    Attributes:
+        maxsize (int): max number of entries, 0 to not cache
+        hits (int): number of lookups found in cache
+        misses (int): number of lookups that had to compute the value
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+
+    def get(self, key, compute):
+        """Return cached value for key, calling compute() to make it if needed."""
+        try:
+            value = self._data.pop(key)
+            self.hits += 1
+        except KeyError:
+            value = compute()
+            self.misses += 1
+            if self.maxsize <= 0: # caching off
+                return value
+            if len(self._data) >= self.maxsize:
+                self._data.popitem(last=False) # least recently used
+        self._data[key] = value # now most recently used
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        """Return dict with hits, misses, size, and maxsize."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'maxsize': self.maxsize}
+
+# Handle for one frame of sound data, as returned by SignalLab.power_spectrum().
+# offset_i is the 0-based index of the first sample of the frame.
+SpectralFrame = collections.namedtuple('SpectralFrame',
+                                       'offset_i blocksize window_it')
+
+# One point of the grid returned by SignalLab.sweep(): time, pitch, goodness
+# and entropy as returned by pitch_features(), stacks and goodness_threshold
+# as found by goodness_of_pitch().
+SweepPoint = collections.namedtuple(
+    'SweepPoint', 'time pitch goodness entropy stacks goodness_threshold')
+
+def _read_only(a):
+    """Mark array read-only (so cached values can't be changed) and return it."""
+    a.flags.writeable = False
+    return a
+
+class EnvelopePyramid(object):
+    """Min/max envelope of sound data at several resolutions, for fast plotting.
+
+    Level 0 holds the min and max of each base samples, and each level above
+    holds the min and max of factor buckets of the level below. Plotting a
+    range of samples from the coarsest level that still has enough buckets
+    draws few points but still shows every peak.
+
+    Attributes:
+        n_samples (int): number of samples the pyramid was built from
+        base (int): samples per bucket at level 0
+        factor (int): buckets of one level per bucket of the next
+        levels (list): (mins, maxs) numpy arrays for each level
+    """
+
+    def __init__(self, n_samples, base, factor, levels):
+        self.n_samples = n_samples
+        self.base = base
+        self.factor = factor
+        self.levels = levels
+
+    @staticmethod
+    def _reduce(mins, maxs, factor):
+        """Min and max of each factor values (last group may be partial)."""
+        n_full = len(mins) // factor * factor
+        out_mins = mins[:n_full].reshape(-1, factor).min(axis=1)
+        out_maxs = maxs[:n_full].reshape(-1, factor).max(axis=1)
+        if n_full < len(mins):
+            out_mins = numpy.append(out_mins, mins[n_full:].min())
+            out_maxs = numpy.append(out_maxs, maxs[n_full:].max())
+        return out_mins, out_maxs
+
+    @classmethod
+    def build(cls, data, base=16, factor=8, min_buckets=256, chunk_size=1 << 20):
+        """Build pyramid from 1-D sound data.
+
+        data is read chunk_size samples at a time, so it works well with
+        memory-mapped data. Levels are added until a level has no more than
+        min_buckets buckets.
+        """
+        chunk_size = chunk_size // base * base
+        mins, maxs = [], []
+        for lo in range(0, len(data), chunk_size):
+            chunk = numpy.asarray(data[lo:lo+chunk_size])
+            chunk_mins, chunk_maxs = cls._reduce(chunk, chunk, base)
+            mins.append(chunk_mins)
+            maxs.append(chunk_maxs)
+        dtype = numpy.asarray(data[:0]).dtype
+        levels = [(numpy.concatenate(mins) if mins else numpy.zeros(0, dtype),
+                   numpy.concatenate(maxs) if maxs else numpy.zeros(0, dtype))]
+        while len(levels[-1][0]) > min_buckets:
+            levels.append(cls._reduce(levels[-1][0], levels[-1][1], factor))
+        return cls(len(data), base, factor, levels)
+
+    def save(self, path):
+        """Save pyramid to npz file."""
+        arrays = {'n_samples': self.n_samples, 'base': self.base,
+                  'factor': self.factor}
+        for i, (mins, maxs) in enumerate(self.levels):
+            arrays['mins_{}'.format(i)] = mins
+            arrays['maxs_{}'.format(i)] = maxs
+        with open(path, 'wb') as f:
+            numpy.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load pyramid saved by save()."""
+        with numpy.load(path) as npz:
+            levels = []
+            while 'mins_{}'.format(len(levels)) in npz.files:
+                i = len(levels)
+                levels.append((npz['mins_{}'.format(i)], npz['maxs_{}'.format(i)]))
+            return cls(int(npz['n_samples']), int(npz['base']),
+                       int(npz['factor']), levels)
+
+    def envelope(self, start_i, stop_i, max_points=4000):
+        """Return envelope of samples start_i up to stop_i, for plotting.
+
+        Uses the finest level with no more than max_points/2 buckets in the
+        range. Each bucket gives two points, its min then its max, at the
+        bucket's first sample, so a line through the points fills the
+        envelope.
+
+        Returns:
+            (x, y) - x is sample index (float) of each point, y is the value
+        """
+        size = self.base
+        for mins, maxs in self.levels:
+            lo = start_i // size
+            hi = min(-(-stop_i // size), len(mins)) # ceil
+            if 2*(hi-lo) <= max_points or size == self.base*self.factor**(len(self.levels)-1):
+                break
+            size *= self.factor
+        x = numpy.repeat(numpy.arange(lo, hi) * float(size), 2)
+        x[0::2] = numpy.maximum(x[0::2], start_i)
+        x[1::2] = x[0::2]
+        y = numpy.empty(2*(hi-lo), dtype=mins.dtype)
+        y[0::2] = mins[lo:hi]
+        y[1::2] = maxs[lo:hi]
+        return x, y
+
+class StackTracker(object):
+    """Finds stacked harmonics (stacks) in goodness-of-pitch measurements.
+
+    A stack is a run of measurements with goodness above a threshold.
+    Measurements may be passed in pieces (see update()) - a stack that is
+    still open at the end of one piece is continued by the next.
+    Each stack is a tuple (start time, duration, list of pitches).
+    """
+
+    def __init__(self):
+        self._start_t = None # start time of open stack, None if no open stack
+        self._pitches = []   # pitches of open stack
+        self._last_t = None  # time of latest measurement
+
+    def update(self, time, pitch, goodness, goodness_threshold):
+        """Process the next piece of measurements, return the stacks it closed.
+
+        Args:
+            time, pitch, goodness (numpy arrays): one value per measurement
+            goodness_threshold (float): absolute threshold
+        """
+        stacks = []
+        if len(time) == 0:
+            return stacks
+        above = numpy.asarray(goodness) > goodness_threshold
+        # split into runs that are all above or all below threshold
+        bounds = numpy.flatnonzero(numpy.diff(above.astype(numpy.int8))) + 1
+        bounds = numpy.concatenate(([0], bounds, [len(above)]))
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            if above[lo]:
+                if self._start_t is None:
+                    # start of stacked harmonic
+                    self._start_t = float(time[lo])
+                self._pitches.extend(numpy.asarray(pitch[lo:hi]).tolist())
+            elif self._start_t is not None:
+                # below threshold - close the stack
+                dur = float(time[lo]) - self._start_t
+                stacks.append((self._start_t, dur, self._pitches))
+                self._start_t = None
+                self._pitches = []
+        self._last_t = float(time[-1])
+        return stacks
+
+    def close(self):
+        """Close stack still open at end of measurements. Returns list of
+        stacks (empty or one stack).
+        """
+        stacks = []
+        if self._start_t is not None:
+            dur = self._last_t - self._start_t
+            stacks.append((self._start_t, dur, self._pitches))
+            self._start_t = None
+            self._pitches = []
+        return stacks
+
+def find_stacks(time, pitch, goodness, threshold, gated_goodness=None):
+    """Return stacks (see StackTracker) in a complete set of measurements.
+
+    Frames with NaN goodness (gated as silent) are never above threshold.
+    They only count toward min and max goodness through gated_goodness.
+
+    Args:
+        threshold (float): relative threshold: 0.0 is min goodness, 1.0 is max.
+        gated_goodness (numpy array): goodness of (a sample of) the frames
+            gated as silent, so the threshold is close to that without the
+            gate
+
+    Returns:
+        (stacks, goodness_threshold)
+    """
+    goodness = numpy.asarray(goodness)
+    if gated_goodness is not None:
+        goodness_range = numpy.concatenate((goodness, gated_goodness))
+    else:
+        goodness_range = goodness
+    known = goodness_range[~numpy.isnan(goodness_range)] # NaN for frames not analyzed
+    if len(known) == 0:
+        return [], numpy.nan
+    mx_good = known.max()
+    mn_good = known.min()
+    goodness_threshold = threshold*(mx_good-mn_good) + mn_good
+    tracker = StackTracker()
+    stacks = tracker.update(time, pitch, goodness, goodness_threshold)
+    stacks += tracker.close()
+    return stacks, goodness_threshold
+
+def _n_cepstrum_points_to_skip(sample_rate, max_pitch_freq):
+    """Return number of cepstrum points to skip when searching for pitch.
+
+    Keep 1st point above max_pitch_freq and all the ones below. The actual
+    max pitch freq is sample_rate/n_skip.
+    """
+    # e.g. sample rate is 44.1 kHz, we want to see 20kHz, so skip
+    # first 3 points of cepstrum
+    #cepstrum_[0] = 0 # no shift MUST CLEAR THIS, zero shift is always max
+    #cepstrum_[1] = 0 # 44.1 kHz (won't be at sample rate, or even 1/2 it
+    #cepstrum_[2] = 0 # 22 kHz - don't want this often-large value boosting goodness-of-pitch
+    n_skip = 1 # always clear 1st point (zero shift)
+    while sample_rate/(n_skip+1) >= max_pitch_freq:
+        n_skip += 1
+    return n_skip
+
+WavHeader = collections.namedtuple(
+    'WavHeader', 'format channels sample_rate bits block_align data_offset data_bytes')
+
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (format, bytes per sample): (numpy dtype, sample_format) of samples SignalLab
+# can read. 24-bit samples have no numpy dtype - see SignalLab._channel_samples()
+_WAV_SAMPLE_TYPES = {
+    (_WAVE_FORMAT_PCM, 2): ('<i2', 'int16'),
+    (_WAVE_FORMAT_PCM, 3): (None, 'int24'),
+    (_WAVE_FORMAT_PCM, 4): ('<i4', 'int32'),
+    (_WAVE_FORMAT_IEEE_FLOAT, 4): ('<f4', 'float32'),
+    (_WAVE_FORMAT_IEEE_FLOAT, 8): ('<f8', 'float64'),
+}
+
+def read_wav_header(path):
+    """Return WavHeader of a RIFF/WAVE file, from its fmt and data chunks.
+
+    Only the chunk headers are read, so this takes the same time for any
+    size of file. For WAVE_FORMAT_EXTENSIBLE files, format is that of the
+    subformat (e.g. 1 for PCM, 3 for float). data_bytes is cut to what the
+    file actually holds, so a truncated file (or one still being written,
+    with a size of 0 or 0xFFFFFFFF in its header) can be read.
+    """
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise TypeError('{} is not a RIFF/WAVE file.'.format(path))
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise TypeError('{} has no data chunk.'.format(path))
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                chunk = f.read(size)
+                fmt = list(struct.unpack('<HHIIHH', chunk[:16]))
+                if fmt[0] == _WAVE_FORMAT_EXTENSIBLE and len(chunk) >= 26:
+                    fmt[0] = struct.unpack('<H', chunk[24:26])[0] # subformat GUID
+                f.seek(size & 1, 1)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise TypeError('{} has no fmt chunk before its data.'.format(path))
+                offset = f.tell()
+                f.seek(0, 2)
+                available = f.tell() - offset
+                if size in (0, 0xFFFFFFFF) or size > available:
+                    size = available
+                format_tag, channels, sample_rate, _, block_align, bits = fmt
+                return WavHeader(format_tag, channels, sample_rate, bits,
+                                 block_align, offset, size)
+            else:
+                f.seek(size + (size & 1), 1) # chunks are word-aligned
+
+def _int24_to_int32(raw):
+    """Return int32 array of the little-endian 24-bit samples in raw, a
+    (..., 3) uint8 array (possibly strided)."""
+    samples = raw[..., 0].astype(numpy.int32)
+    samples |= raw[..., 1].astype(numpy.int32) << 8
+    samples |= raw[..., 2].view(numpy.int8).astype(numpy.int32) << 16
+    return samples
+
+class Int24Samples(object):
+    """24-bit samples (which have no numpy type), converted to int32 only
+    where indexed.
+
+    Indexing works as for a numpy array of samples (by channels, for more
+    than one channel), except that the result is always a new int32 array
+    converted from just the samples asked for - so slicing a memory-mapped
+    file reads only that part of it. numpy.asarray() converts them all.
+
+    Attributes:
+        shape (tuple): samples, or samples by channels
+        ndim (int): 1 or 2
+        dtype (numpy dtype): int32
+    """
+
+    dtype = numpy.dtype(numpy.int32)
+
+    def __init__(self, raw):
+        """
+        Args:
+            raw (numpy uint8 array): samples (by channels) by 3 bytes
+        """
+        self._raw = raw
+        self.shape = raw.shape[:-1]
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        return _int24_to_int32(self._raw[key + (slice(None),)*(self.ndim + 1 - len(key))])
+
+    def __array__(self, dtype=None, copy=None):
+        samples = numpy.empty(self.shape, self.dtype)
+        chunk_size = 1 << 20
+        for lo in range(0, len(self), chunk_size):
+            samples[lo:lo+chunk_size] = self[lo:lo+chunk_size]
+        return samples if dtype is None else samples.astype(dtype)
+
 class SignalLab(object):
     """Class for opening, plotting, and analyzing sound files (only wav for now).
 
     Attributes:
         path (str): full path of opened file
         sample_rate (float) : sample rate of opened file in Hz
-        n_wav_samps (int): number of samples
-        sound_data (numpy int16 array): the raw sound data
+        n_wav_samps (int): number of samples (per channel)
+        n_channels (int): number of channels in the sound file
+        channel_index (int): the channel in sound_data - see channel()
+        sample_format (str): type of the samples in the sound file - one of
+            int16, int24, int32, float32, float64
+        sound_data (numpy array): the samples of channel channel_index, as
+            stored in the file (int16, int32 or float) - a zero-copy strided
+            view of the file's interleaved data. 24-bit samples have no numpy
+            type, so it is then an Int24Samples, which converts to int32 just
+            the samples it is sliced by.
+        channel_data (numpy array): all channels, samples by channels -
+            zero-copy as for sound_data. Used by the all_channels analyses.
         delta_t (float): 1/sample_rate
-        sample_times (numpy float array): time of each sample, first time is zero
+        sample_times (numpy float array): time of each sample, first time is
+            zero. Built on first use when mmap is True - see times().
         max_pitch_freq (float): based on user-supplied max_pitch_freq
+        frames_per_batch (int): max frames analyzed per FFT call by
+            pitch_features() - bounds memory use on long files
+        window_cache_size (int): number of windows (one per blocksize) cached
+        frame_cache_size (int): number of power spectra, and of cepstra, cached
+        cache (siglab_cache.AnalysisCache): persistent cache of
+            goodness_of_pitch() and spectrogram() results, or None
+        max_plot_points (int): plot_time() plots the envelope (see
+            envelope_pyramid()) instead of every sample when plotting more
+            samples than this
+        instrumentation (Instrumentation): per-stage counters and timers
+        gate_auto_factor (float): with gate='auto', frames with RMS below
+            this times the 10th percentile of frame RMS are silent
+        gate_auto_ceiling (float): the 'auto' gate is never above this
+            times the 99th percentile of frame RMS, so a recording without
+            silences (whose 10th percentile is the signal) is not gated
+        gate_floor_frames (int): max silent frames whose goodness
+            goodness_of_pitch() finds, for the min goodness of gated runs
+        dtype (numpy dtype): float type used for analysis - float32 in
+            compact mode, else float64
+        decimation (int): factor the sound file was decimated by to get
+            sound_data - see decimated()
+        decimation_passband (float): fraction of the sample rate that
+            decimated() keeps - used by decimation_for()
     """
 
-    def __init__(self, path, max_pitch_freq=4.2e3):
+    frames_per_batch = 2048
+    window_cache_size = 8
+    frame_cache_size = 128
+    max_plot_points = 4000
+    gate_auto_factor = 4.0
+    gate_auto_ceiling = 0.5
+    gate_floor_frames = 64
+    decimation = 1
+    decimation_passband = 0.475
+
+    def __init__(self, path, max_pitch_freq=4.2e3, mmap=False, cache=None,
+                 instrumentation=None, compact=False):
         """This just opens, reads, and closes the wav file.
 
+        16-, 24- and 32-bit integer and 32- and 64-bit float samples are
+        supported, with any number of channels. Analysis is of channel 0
+        unless all_channels is given - see channel() for the others.
+
         Args:
             path (str): full path of file to open
             max_pitch_freq (float): used by cepstrum. Max pitch freq we care about.
+            mmap (bool): if True, memory-map the sound data instead of reading
+                it. Opening takes the same time for any size of file, and only
+                the parts of the file that are analyzed or plotted are read.
+            cache (siglab_cache.AnalysisCache): if given, results of
+                goodness_of_pitch() and spectrogram() are kept in this cache
+            instrumentation (Instrumentation): if given, stages of loading and
+                analysis are counted and timed (see Instrumentation)
+            compact (bool): if True, analyze in float32 instead of float64 and
+                don't store sample_times, to halve memory use and bandwidth.
+                Results differ from float64 ones by float32 rounding.
         """
-        try:
-            snd = wave.open(path, 'r')
-            self.path = path
-            if snd.getsampwidth() != 2:
-                raise TypeError('{} has {}-byte samples. Expecting 2-byte samples.')
-            self.sample_rate = float(snd.getframerate())
-            self.n_wav_samps = snd.getnframes()
-            stream = snd.readframes(self.n_wav_samps)
-            self.sound_data = numpy.fromstring(string=stream, dtype=numpy.int16)
-            self.delta_t = 1.0/self.sample_rate
-            self.sample_times = numpy.arange(0,
-                                             (self.n_wav_samps+1)*self.delta_t,
-                                             self.delta_t)
-            self.window = numpy.zeros(2) # don't know window size. won't be 2.
-
-            # calc self._n_cepstrum_points_to_skip_for_pitch - keep 1st point above
-            # max_pitch_freq and all the ones below.
-            # actual max freq is stored in self.max_pitch_freq
-            # e.g. sample rate is 44.1 kHz, we want to see 20kHz, so skip
-            # first 3 points of cepstrum
-            #cepstrum_[0] = 0 # no shift MUST CLEAR THIS, zero shift is always max
-            #cepstrum_[1] = 0 # 44.1 kHz (won't be at sample rate, or even 1/2 it
-            #cepstrum_[2] = 0 # 22 kHz - don't want this often-large value boosting goodness-of-pitch
-            self._n_cepstrum_points_to_skip_for_pitch = 1 # always clear 1st point (zero shift)
-            while True:
-                next_f = self.sample_rate/(self._n_cepstrum_points_to_skip_for_pitch+1)
-                if next_f < max_pitch_freq:
-                    break
-                self._n_cepstrum_points_to_skip_for_pitch += 1
-            self.max_pitch_freq = self.sample_rate/self._n_cepstrum_points_to_skip_for_pitch
-        finally:
-            snd.close()
+        header = read_wav_header(path)
+        self.path = path
+        self.cache = cache
+        self.instrumentation = instrumentation or _NO_INSTRUMENTATION
+        self.dtype = numpy.dtype(numpy.float32 if compact else numpy.float64)
+        sample_width = header.block_align // max(header.channels, 1)
+        sample_type = _WAV_SAMPLE_TYPES.get((header.format, sample_width))
+        if sample_type is None or header.channels < 1 or \
+           sample_width*header.channels != header.block_align:
+            raise TypeError('{} has {}-byte samples of format {}. Expecting 16-, '
+                            '24- or 32-bit integer or 32- or 64-bit float samples.'.format(
+                                path, sample_width, header.format))
+        self._sample_dtype, self.sample_format = sample_type
+        self.n_channels = header.channels
+        self.channel_index = 0
+        self.sample_rate = float(header.sample_rate)
+        self.n_wav_samps = header.data_bytes // header.block_align
+        self.delta_t = 1.0/self.sample_rate
+        self._sample_times = None
+        n_bytes = self.n_wav_samps*header.block_align
+        if mmap:
+            self._raw = numpy.memmap(path, dtype=numpy.uint8, mode='r',
+                                     offset=header.data_offset, shape=(n_bytes,))
+        else:
+            with self.instrumentation.stage('decode', self.n_wav_samps):
+                with open(path, 'rb') as f:
+                    f.seek(header.data_offset)
+                    self._raw = numpy.frombuffer(f.read(n_bytes), dtype=numpy.uint8)
+            if not compact:
+                self._sample_times = self.times(0, self.n_wav_samps+1)
+        self._sound_data = None # set by sound_data
+        self._channels = {0: self} # set by channel(), shared by all channels
+        self._init_caches()
+        self._set_max_pitch_freq(max_pitch_freq)
+
+    def _init_caches(self):
+        """Set up (empty) caches of things computed from sound_data."""
+        self._window_cache = LRUCache(self.window_cache_size)
+        self._power_cache = LRUCache(self.frame_cache_size)
+        self._cepstrum_cache = LRUCache(self.frame_cache_size)
+        self._last_frame = None # set by power_spectrum()
+        self._work = _WorkBuffers() # for power_spectrum() and cepstrum()
+        self._envelope = None   # set by envelope_pyramid()
+        self._decimated = {}    # set by decimated()
+
+    def _set_max_pitch_freq(self, max_pitch_freq):
+        self._requested_max_pitch_freq = max_pitch_freq # for decimated()
+        self._n_cepstrum_points_to_skip_for_pitch = _n_cepstrum_points_to_skip(
+            self.sample_rate, max_pitch_freq)
+        # actual max freq
+        self.max_pitch_freq = self.sample_rate/self._n_cepstrum_points_to_skip_for_pitch
+
+    def _channel_samples(self, index):
+        """Return samples of channel index of the sound file - a strided
+        view of the raw data, or for 24-bit samples, an Int24Samples."""
+        n_samples, n_channels = self.n_wav_samps, self.n_channels
+        if self._sample_dtype is not None:
+            return self._raw.view(self._sample_dtype).reshape(
+                n_samples, n_channels)[:, index]
+        return Int24Samples(self._raw.reshape(n_samples, n_channels, 3)[:, index])
+
+    @property
+    def sound_data(self):
+        if self._sound_data is None:
+            self._sound_data = self._channel_samples(self.channel_index)
+        return self._sound_data
+
+    @sound_data.setter
+    def sound_data(self, data):
+        # data (1-D) replaces the sound file - it is now the only channel
+        self._sound_data = data
+        self._raw = None
+        self.n_channels = 1
+
+    @property
+    def channel_data(self):
+        if self._raw is None:
+            return self.sound_data[:, numpy.newaxis]
+        if self._sample_dtype is not None:
+            return self._raw.view(self._sample_dtype).reshape(
+                self.n_wav_samps, self.n_channels)
+        return Int24Samples(self._raw.reshape(self.n_wav_samps, self.n_channels, 3))
+
+    def channel(self, index):
+        """Return (cached) SignalLab of channel index of the sound file.
+
+        It shares the sound file (and its memory map, if any), cache and
+        instrumentation, but has its own sound_data - a view of the channel
+        - and its own caches. Results kept in self.cache are kept separately
+        for each channel.
+
+        Args:
+            index (int): channel, 0 to n_channels-1
+        """
+        if index == self.channel_index:
+            return self
+        if self._raw is None:
+            raise ValueError('{} has no other channels - it is decimated or its '
+                             'sound_data was replaced'.format(self.path))
+        if not 0 <= index < self.n_channels:
+            raise IndexError('{} has {} channels, no channel {}'.format(
+                self.path, self.n_channels, index))
+        lab = self._channels.get(index)
+        if lab is None:
+            lab = copy.copy(self) # same path, file, cache, instrumentation, dtype
+            lab.channel_index = index
+            lab._sound_data = None
+            lab._init_caches()
+            self._channels[index] = lab
+        return lab
+
+    def _frames_per_batch(self, all_channels):
+        """Return frames per batch that keeps all_channels analyses to
+        about the memory of frames_per_batch frames of one channel."""
+        if not all_channels:
+            return self.frames_per_batch
+        return max(1, self.frames_per_batch // self.n_channels)
+
+    def decimated(self, factor):
+        """Return (cached) SignalLab of sound_data low-pass filtered and
+        decimated by factor - see decimate().
+
+        The result has sample_rate divided by factor, and times, frequency
+        axes and max_pitch_freq (and so the cepstrum points skipped) to
+        match. Its analysis uses FFTs factor times smaller for the same
+        frequency resolution: e.g. goodness_of_pitch(blocksize=1024) here
+        is like decimated(4).goodness_of_pitch(blocksize=256), minus the
+        harmonics above the decimated passband. Results kept in self.cache
+        are kept separately for each factor.
+
+        Decimating a decimated SignalLab decimates the undecimated one by
+        the product of the factors, in one step, so the result depends only
+        on the total factor.
+
+        Args:
+            factor (int): decimation factor, 1 for self
+        """
+        if factor == 1:
+            return self
+        if self.decimation != 1:
+            return self._undecimated.decimated(self.decimation*factor)
+        lab = self._decimated.get(factor)
+        if lab is None:
+            lab = copy.copy(self) # same path, cache, instrumentation, dtype
+            with self.instrumentation.stage('decimation', self.n_wav_samps):
+                lab.sound_data = decimate(self.sound_data, factor)
+            lab.sample_rate = self.sample_rate/factor
+            lab.delta_t = 1.0/lab.sample_rate
+            lab.n_wav_samps = len(lab.sound_data)
+            lab._sample_times = None
+            lab.decimation = factor
+            lab._undecimated = self
+            lab._init_caches()
+            lab._set_max_pitch_freq(self._requested_max_pitch_freq)
+            self._decimated[factor] = lab
+        return lab
 
-    def _plot_time(self, data, offset_i, num_points, title='', ylabel='Counts'):
+    def decimation_for(self, max_freq):
+        """Return largest decimation factor (a power of 2) whose passband
+        (see decimation_passband) still reaches max_freq."""
+        factor = 1
+        while self.sample_rate/(2*factor)*self.decimation_passband >= max_freq:
+            factor *= 2
+        return factor
+
+    @property
+    def sample_times(self):
+        if self._sample_times is None:
+            self._sample_times = self.times(0, self.n_wav_samps+1)
+        return self._sample_times
+
+    def times(self, start_i, stop_i):
+        """Return time of samples start_i up to (not including) stop_i.
+
+        Computed on demand, so only the requested times are stored.
+        """
+        return numpy.arange(start_i, stop_i)*self.delta_t
+
+    def _plot_time(self, data, offset_i, num_points, title='', ylabel='Counts',
+                   times=None):
         """Used internally to plot time history data.
 
         Args:
             data (numpy array): data to plot. Will use first sample passed, so
                     caller must send slice if he wants to plot from an offset.
-            offset_i (int): 0-based index, used to index into sample_times
+            offset_i (int): 0-based index of first sample, used to compute times
             num_points (int): number of samples to plot
             title (str): plot title
             ylabel (str): label to use for Y-axis
+            times (numpy array): time of each point, if data is not evenly
+                    spaced samples
 
         May be overridden to plot using different library or method (e.g. to PNG file).
         """
-        plt.figure(figsize=(8.0, 4.0), dpi=80)
-        subplot = plt.subplot(1,1,1) # only needed if I want to call subplot methods
-        plt.plot(self.sample_times[offset_i:offset_i+num_points],
-                 data[:num_points],
-                 'r')
-        plt.title(title)
-        plt.xlabel('Seconds')
-        plt.ylabel(ylabel)
-        subplot.set_autoscale_on(True)
-        plt.grid(True)
+        with self.instrumentation.stage('plotting'):
+            plt = _pyplot()
+            plt.figure(figsize=(8.0, 4.0), dpi=80)
+            subplot = plt.subplot(1,1,1) # only needed if I want to call subplot methods
+            if times is None:
+                times = self.times(offset_i, offset_i+num_points)
+            plt.plot(times[:num_points],
+                     data[:num_points],
+                     'r')
+            plt.title(title)
+            plt.xlabel('Seconds')
+            plt.ylabel(ylabel)
+            subplot.set_autoscale_on(True)
+            plt.grid(True)
 
     def _plot_freq(self, data, blocksize, title='', xlabel='Hz', ylabel=''):
-        plt.figure(figsize=(8.0, 4.0), dpi=80)
-        subplot = plt.subplot(1,1,1) # only needed if I want to call subplot methods
-        delta_f = self.sample_rate/blocksize # 1/T
-        x_scale = numpy.arange(0, (blocksize/2+1)*delta_f, delta_f)[:blocksize/2]
-        plt.plot(x_scale, data, 'r')
-        plt.title(title)
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        subplot.set_autoscale_on(True)
-        plt.grid(True)
+        with self.instrumentation.stage('plotting'):
+            plt = _pyplot()
+            plt.figure(figsize=(8.0, 4.0), dpi=80)
+            subplot = plt.subplot(1,1,1) # only needed if I want to call subplot methods
+            delta_f = self.sample_rate/blocksize # 1/T
+            x_scale = numpy.arange(0, (blocksize//2+1)*delta_f, delta_f)[:blocksize//2]
+            plt.plot(x_scale, data, 'r')
+            plt.title(title)
+            plt.xlabel(xlabel)
+            plt.ylabel(ylabel)
+            subplot.set_autoscale_on(True)
+            plt.grid(True)
 
     def plot_time(self, offset_time=0.0, duration=None, num_points=None, 
                   title=None):
@@ -158,10 +1222,109 @@ class SignalLab(object):
             num_points = self.n_wav_samps
         max_num_points = self.n_wav_samps - offset_i
         num_points = min(num_points, max_num_points)
-        self._plot_time(self.sound_data[offset_i:], offset_i, num_points, title=title)
+        if num_points > self.max_plot_points:
+            x, y = self.envelope_pyramid().envelope(
+                offset_i, offset_i+num_points, self.max_plot_points)
+            self._plot_time(y, offset_i, len(y), title=title,
+                            times=x*self.delta_t)
+        else:
+            self._plot_time(self.sound_data[offset_i:offset_i+num_points],
+                            offset_i, num_points,
+                            title=title)
+
+    def envelope_pyramid(self, save=False):
+        """Return (built once) EnvelopePyramid of sound_data.
+
+        Loaded from path + '.envelope.npz' if that exists and is newer than
+        the sound file.
+
+        Args:
+            save (bool): if True, save pyramid to path + '.envelope.npz'
+                (ignored for decimated() and for channel() other than 0)
+        """
+        if self.decimation != 1 or self.channel_index != 0 or self._raw is None:
+            if self._envelope is None:
+                self._envelope = EnvelopePyramid.build(self.sound_data)
+            return self._envelope
+        if self._envelope is None:
+            envelope_path = self.path + '.envelope.npz'
+            try:
+                if os.path.getmtime(envelope_path) >= os.path.getmtime(self.path):
+                    envelope = EnvelopePyramid.load(envelope_path)
+                    if envelope.n_samples == len(self.sound_data):
+                        self._envelope = envelope
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+            if self._envelope is None:
+                self._envelope = EnvelopePyramid.build(self.sound_data)
+        if save:
+            self._envelope.save(self.path + '.envelope.npz')
+        return self._envelope
+
+    def _cached(self, kind, params, compute):
+        """Return compute() (a dict of arrays), via self.cache if there is one."""
+        if self.cache is None:
+            return compute()
+        if self.decimation != 1:
+            params = dict(params, decimation=self.decimation)
+        if self.channel_index != 0:
+            params = dict(params, channel=self.channel_index)
+        return self.cache.get(self.path, kind, params, compute)
+
+    def spectrogram(self, offset_time=0.0, duration=None, num_points=None,
+                    blocksize=512, max_freq=None, decimation=1,
+                    all_channels=False):
+        """Compute spectrogram of sound file, half-overlapped Hann windows.
+
+        Args: see plot_spectrogram(), and
+            all_channels (bool): if True, compute spectrogram of every
+                channel, all channels of each batch of frames in one FFT call
+
+        Returns:
+            (Pxx, freqs, bins) - power (freq by time, or with all_channels,
+            channel by freq by time), frequency of each row in Hz, time of
+            each column in seconds (from offset_time)
+        """
+        if decimation == 'auto':
+            decimation = self.decimation_for(max_freq) if max_freq else 1
+        if all_channels and decimation != 1:
+            # each channel is decimated on its own
+            results = [self.channel(index).spectrogram(
+                offset_time, duration, num_points, blocksize, max_freq,
+                decimation) for index in range(self.n_channels)]
+            return (numpy.array([Pxx for Pxx, freqs, bins in results]),
+                    results[0][1], results[0][2])
+        if decimation != 1:
+            if duration is None and num_points is not None:
+                duration = num_points*self.delta_t
+            return self.decimated(decimation).spectrogram(
+                offset_time, duration, None, max(1, blocksize//decimation),
+                max_freq)
+        offset_i = int(0.5 + offset_time*self.sample_rate)
+        if duration:
+            num_points = int(0.5 + duration*self.sample_rate)
+        elif num_points is None:
+            num_points = self.n_wav_samps
+        max_num_points = self.n_wav_samps - offset_i
+        num_points = min(num_points, max_num_points)
+
+        def compute():
+            data = self.channel_data if all_channels else self.sound_data
+            Pxx, freqs, bins = stft_power(
+                data, blocksize, blocksize//2, self.sample_rate, max_freq,
+                frames_per_batch=self._frames_per_batch(all_channels),
+                instrumentation=self.instrumentation, start=offset_i,
+                stop=offset_i+num_points)
+            return {'Pxx': Pxx, 'freqs': freqs, 'bins': bins}
+        params = {'offset_i': offset_i, 'num_points': num_points,
+                  'blocksize': blocksize, 'max_freq': max_freq}
+        if all_channels:
+            params['all_channels'] = True
+        result = self._cached('spectrogram', params, compute)
+        return result['Pxx'], result['freqs'], result['bins']
 
     def plot_spectrogram(self, offset_time=0.0, duration=None, num_points=None,
-                  blocksize=512, max_freq=None, title=None):
+                  blocksize=512, max_freq=None, title=None, decimation=1):
         """Plot spectrogram of sound file.
 
         Args:
@@ -171,75 +1334,132 @@ class SignalLab(object):
             blocksize (int): FFT blocksize
             max_freq (float): max freq of interest
             title (str): title of plot
+            decimation (int or str): if more than 1, compute from
+                decimated(decimation) with blocksize divided by it, for the
+                same resolution in time and frequency from smaller FFTs.
+                'auto' for the largest decimation_for(max_freq).
         """
         if title is None:
             title = self.path
         if offset_time:
             title += ' offset of {0:.3f} sec'.format(offset_time)
-        offset_i = int(0.5 + offset_time*self.sample_rate)
-        if duration:
-            num_points = int(0.5 + duration*self.sample_rate)
-        elif num_points is None:
-            num_points = self.n_wav_samps
-        max_num_points = self.n_wav_samps - offset_i
-        num_points = min(num_points, max_num_points)
+        Pxx, freqs, bins = self.spectrogram(offset_time, duration, num_points,
+                                            blocksize, max_freq, decimation)
+
+        with self.instrumentation.stage('plotting'):
+            plt = _pyplot()
+            plt.figure(figsize=(8.0, 4.0), dpi=80)
+            Z = numpy.log10(Pxx)
+            Z *= 10.
+            extent = 0, numpy.amax(bins), freqs[0], freqs[-1]
+            plt.imshow(Z, origin='lower', extent=extent)
+            plt.axis('auto')
+            plt.title(title)
+            plt.xlabel('Seconds')
+            plt.ylabel('Hz')
+
+    def _window(self, blocksize):
+        """Return (cached) Hann window for blocksize."""
+        return self._window_cache.get(
+            blocksize, lambda: _read_only(hann_window(blocksize, self.dtype)))
 
-        plt.figure(figsize=(8.0, 4.0), dpi=80)
-        #spectrum, freqs, t, im  = plt.specgram(
-        spectrum, freqs, t, im  = specgram_freq_limit(
-            self.sound_data[offset_i:offset_i+num_points], NFFT=blocksize,
-            Fs=self.sample_rate,
-            window=mlab.window_hanning, noverlap=blocksize/2,
-            maxfreq=max_freq) # new - limit freq
-        plt.title(title)
-        plt.xlabel('Seconds')
-        plt.ylabel('Hz')
+    def frame(self, offset_time, blocksize, window_it=True):
+        """Return SpectralFrame handle for the frame starting at offset_time."""
+        return SpectralFrame(int(0.5 + offset_time*self.sample_rate),
+                             blocksize, window_it)
+
+    def frame_power(self, frame):
+        """Return (cached) two-sided power spectrum of frame (a SpectralFrame)."""
+        def compute():
+            i = frame.offset_i
+            fft_input = self.sound_data[i:i+frame.blocksize] # numpy - does not copy
+            if frame.window_it:
+                with self.instrumentation.stage('windowing'):
+                    fft_input = numpy.multiply(
+                        fft_input, self._window(frame.blocksize),
+                        out=self._work.get('windowed', fft_input.shape, self.dtype))
+            with self.instrumentation.stage('fft'):
+                fft = numpy.fft.fft(fft_input)
+                power = numpy.square(fft.real,
+                                     out=numpy.empty(len(fft), self.dtype))
+                power += numpy.square(fft.imag,
+                                      out=self._work.get('imag2', power.shape, self.dtype))
+                return _read_only(power)
+        return self._power_cache.get(frame, compute)
+
+    def frame_cepstrum(self, frame):
+        """Return (cached) cepstrum of frame (a SpectralFrame)."""
+        def compute():
+            power = self.frame_power(frame)
+            with self.instrumentation.stage('cepstrum'):
+                log_power = numpy.log(power, out=self._work.get(
+                    'log_power', power.shape, self.dtype))
+                return _read_only(numpy.abs(numpy.fft.ifft(log_power)).astype(
+                    self.dtype, copy=False))
+        return self._cepstrum_cache.get(frame, compute)
+
+    def cache_stats(self):
+        """Return hit/miss statistics of the window, power spectrum and
+        cepstrum caches, as dict of dicts (see LRUCache.stats()).
+        """
+        return {'window': self._window_cache.stats(),
+                'power': self._power_cache.stats(),
+                'cepstrum': self._cepstrum_cache.stats()}
 
     def power_spectrum(self, offset_time, blocksize, window_it=True,
                        plot_it=True, title=None):
         """Compute and plot power spectrum of sound file.
+
+        The power spectrum is also stored in self.power, and the frame is
+        used by later calls to autocorrelation() and cepstrum() that don't
+        pass a frame.
+
+        Returns:
+            SpectralFrame handle for the frame
         """
         # TODO: verify alg
-        i = int(0.5 + offset_time*self.sample_rate)
-        fft_input = self.sound_data[i:i+blocksize] # numpy - does not copy
-        if window_it:
-            if self.window.shape != (blocksize,):
-                # hann window
-                d = 2.0 * numpy.pi / (blocksize-1)
-                twopi = 2.0 * numpy.pi
-                self.window = 0.5 * (1.0 - numpy.cos(
-                    numpy.arange(0.0, twopi+d, d, dtype=numpy.float32)))
-            fft_input = fft_input.copy() # make copy
-            fft_input *= self.window
-        fft = numpy.fft.fft(fft_input)
-        self.power = fft*fft
-        self.power = numpy.abs(self.power) # combine with line above?
+        frame = self.frame(offset_time, blocksize, window_it)
+        self._last_frame = frame
+        self.power = self.frame_power(frame)
         if plot_it:
             if title is None:
                 title = 'Power spectrum'
-            self._plot_freq(self.power[:blocksize/2], blocksize,
+            self._plot_freq(self.power[:blocksize//2], blocksize,
                             title=title, xlabel='Hz',
                             ylabel='power (no units)')
+        return frame
+
+    def _frame_or_last(self, frame):
+        if frame is None:
+            frame = self._last_frame
+            if frame is None:
+                raise ValueError('No frame given and power_spectrum() not called.')
+        return frame
 
-    def autocorrelation(self, num_points, title=None):
+    def autocorrelation(self, num_points, title=None, frame=None):
         """Compute and plot autocorrelation of sound file.
 
-        Uses result from power_spectrum()
+        Args:
+            frame (SpectralFrame): frame to use, default is frame from last
+                call to power_spectrum()
         """
         # TODO: verify alg
         if title is None:
             title = 'Autocorrelation'
-        autoc = numpy.abs(numpy.fft.ifft(self.power))
+        power = self.frame_power(self._frame_or_last(frame))
+        autoc = numpy.abs(numpy.fft.ifft(power))
         self._plot_time(autoc, offset_i=0, num_points=num_points,
                         title=title, ylabel='autocorrelation')
 
-    def cepstrum(self, num_points, plot_it=True, title=None):
+    def cepstrum(self, num_points, plot_it=True, title=None, frame=None):
         """Compute and plot cepstrum of sound file, return pitch and goodness-of-pitch.
 
-        Uses result from power_spectrum()
+        Args:
+            frame (SpectralFrame): frame to use, default is frame from last
+                call to power_spectrum()
         """
         # TODO: verify alg
-        cepstrum_ = numpy.abs(numpy.fft.ifft(numpy.log(self.power)))
+        cepstrum_ = self.frame_cepstrum(self._frame_or_last(frame))
 
         # compute pitch, goodness_of_pitch
         n_skip = self._n_cepstrum_points_to_skip_for_pitch
@@ -250,112 +1470,583 @@ class SignalLab(object):
         if plot_it:
             if title is None:
                 title = 'Cepstrum'
+            cepstrum_ = cepstrum_.copy() # cached copy is read-only
             cepstrum_[0] = 0 # clear the zero-shift point so it doesn't affect scale
+            plt = _pyplot()
             self._plot_time(cepstrum_, offset_i=0, num_points=num_points,
                             title=title, ylabel='cepstrum')
-            plt.annotate(xy=(self.sample_times[indx_max], goodness_of_pitch),
+            plt.annotate(xy=(indx_max*self.delta_t, goodness_of_pitch),
                          s='{0:.0f}Hz'.format(pitch), color='b')
 
         return goodness_of_pitch, pitch
 
+    def _frame_times(self, blocksize, overlap):
+        """Return (start index, center time) of each frame used by pitch_features().
+
+        Frame offsets are accumulated in seconds, as the original per-frame
+        loop did, so the same frames are chosen.
+        """
+        dur_of_N = blocksize*self.delta_t # how much time N represents
+        end_time = (self.n_wav_samps-1)*self.delta_t
+        inc_t = dur_of_N - overlap*dur_of_N
+        if inc_t <= 0.0:
+            raise ValueError('overlap must be less than 1.0, got {}'.format(overlap))
+        n_max = max(0, int((end_time - dur_of_N)/inc_t) + 2)
+        offsets = numpy.concatenate(([0.0], numpy.full(n_max, inc_t))).cumsum()
+        offsets = offsets[offsets + dur_of_N < end_time]
+        starts = (0.5 + offsets*self.sample_rate).astype(numpy.intp)
+        return starts, offsets + 0.5*dur_of_N
+
+    def frame_rms(self, blocksize=1024, overlap=.50):
+        """Return (time, rms) of the frames used by song_features()."""
+        starts, time = self._frame_times(blocksize, overlap)
+        with self.instrumentation.stage('gating', len(starts)):
+            return time, frame_rms(self.sound_data, starts, blocksize,
+                                   self.frames_per_batch)
+
+    def _silent_frames(self, starts, blocksize, gate, all_channels=False):
+        """Return bool array, True for frames with RMS below gate.
+
+        Args:
+            gate (float or str): RMS in counts, or 'auto' for
+                gate_auto_factor times the 10th percentile of frame RMS, but
+                no more than gate_auto_ceiling times the 99th percentile
+            all_channels (bool): if True, True for frames below the gate
+                (each channel's own, for 'auto') in every channel
+        """
+        if all_channels:
+            silent = numpy.ones(len(starts), bool)
+            for index in range(self.n_channels):
+                silent &= self.channel(index)._silent_frames(starts, blocksize,
+                                                             gate)
+            return silent
+        with self.instrumentation.stage('gating', len(starts)):
+            rms = frame_rms(self.sound_data, starts, blocksize,
+                            self.frames_per_batch)
+            if gate == 'auto':
+                gate = min(self.gate_auto_factor*numpy.percentile(rms, 10),
+                           self.gate_auto_ceiling*numpy.percentile(rms, 99)) \
+                       if len(rms) else 0.0
+            return rms < gate
+
+    def _gated_goodness(self, blocksize, overlap, goodness, all_channels=False):
+        """Return goodness of up to gate_floor_frames of the frames that
+        goodness (from pitch_features()) has as NaN - gated as silent in
+        every channel - spread evenly among them."""
+        starts, time = self._frame_times(blocksize, overlap)
+        silent = numpy.isnan(goodness)
+        if all_channels:
+            silent = silent.all(axis=0)
+        silent_starts = starts[silent]
+        if len(silent_starts) > self.gate_floor_frames:
+            silent_starts = silent_starts[numpy.unique(numpy.linspace(
+                0, len(silent_starts)-1, self.gate_floor_frames).astype(int))]
+        return _features_at(self.channel_data if all_channels else self.sound_data,
+                            silent_starts, blocksize, self._window(blocksize),
+                            self._n_cepstrum_points_to_skip_for_pitch,
+                            self.sample_rate, ('goodness',),
+                            self._frames_per_batch(all_channels),
+                            self.instrumentation)['goodness']
+
+    def song_features(self, blocksize=1024, overlap=.50, features=SONG_FEATURES,
+                      workers=None, processes=False, gate=None,
+                      all_channels=False):
+        """Compute song features of whole sound file in a single pass.
+
+        Frames are taken as strided views of sound_data and analyzed
+        frames_per_batch at a time, with one real FFT per frame shared by
+        all the features. Feature fields are of type self.dtype.
+
+        With workers, the frames are split into contiguous segments (whose
+        samples overlap by blocksize minus the hop) that are analyzed
+        concurrently, then stitched back together in order. The result is
+        the same as with no workers.
+
+        With gate, a cheap pass finds the RMS of each frame (see
+        frame_rms()) and frames below the gate are not analyzed: their
+        features are NaN, as is fm of the frame after one.
+
+        With all_channels, every channel is analyzed in the same pass:
+        frames of all channels are strided views of channel_data, and go
+        through the same FFT calls (frames_per_batch is shared among the
+        channels). The values of each channel are the same as those of
+        channel(index).song_features().
+
+        Features (any of SONG_FEATURES):
+            pitch (Hz) and goodness: as returned by cepstrum()
+            entropy: Wiener entropy, geometric over arithmetic mean of the
+                power spectrum (0 to 1, 1 for white noise)
+            mean_freq (Hz): power-weighted mean frequency
+            fm (degrees): frequency modulation, from the change of the log
+                spectrum since the previous frame against its change across
+                frequency, both weighted by power - 0 for a steady tone,
+                toward 90 as the spectrum sweeps. NaN for the first frame.
+            amplitude (dB): 10*log10 of mean power
+
+        Args:
+            blocksize (int): FFT blocksize
+            overlap (float): frame overlap as a fraction - .25 is 25%
+            features (sequence of str): features to compute
+            workers (int): number of threads (or processes) to use, None or 1
+                to analyze in this thread. numpy FFTs release the GIL, so
+                threads scale with cores.
+            processes (bool): if True, use processes instead of threads. Each
+                process memory-maps the file at self.path.
+            gate (float or str): None to analyze every frame, RMS (in
+                counts) below which frames are silent and not analyzed, or
+                'auto' for gate_auto_factor times the 10th percentile of
+                frame RMS (but no more than gate_auto_ceiling times the 99th
+                percentile, so steady sound isn't gated). With all_channels, frames are silent when they
+                are in every channel.
+            all_channels (bool): if True, analyze every channel
+
+        Returns:
+            numpy structured array, one row per frame, with field 'time'
+            (center of frame in seconds), a float field for each feature (of
+            n_channels values with all_channels), and, with gate, bool field
+            'silent'
+        """
+        starts, time = self._frame_times(blocksize, overlap)
+        if all_channels:
+            data = self.channel_data
+            dtype = [('time', numpy.float64)] + [(name, self.dtype, (self.n_channels,))
+                                                  for name in features]
+        else:
+            data = self.sound_data
+            dtype = [('time', numpy.float64)] + [(name, self.dtype) for name in features]
+        if gate is not None:
+            dtype.append(('silent', numpy.bool_))
+        result = numpy.empty(len(starts), dtype=dtype)
+        result['time'] = time
+        active = None
+        if gate is not None:
+            result['silent'] = self._silent_frames(starts, blocksize, gate,
+                                                   all_channels)
+            active = ~result['silent']
+        n_skip = self._n_cepstrum_points_to_skip_for_pitch
+        frames_per_batch = self._frames_per_batch(all_channels)
+        if not workers or workers == 1 or len(starts) < 2:
+            values = _features_at(data, starts, blocksize,
+                                  self._window(blocksize), n_skip,
+                                  self.sample_rate, features,
+                                  frames_per_batch, self.instrumentation,
+                                  active=active)
+            for name in features:
+                result[name] = values[name].T
+            return result
+
+        n_segments = min(len(starts), 2*workers) # 2 per worker to balance load
+        bounds = numpy.linspace(0, len(starts), n_segments+1).astype(int)
+        segments = []
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            prev_start = None
+            if lo and (active is None or active[lo-1]):
+                prev_start = starts[lo-1]
+            segments.append((lo, hi, prev_start,
+                             None if active is None else active[lo:hi]))
+        if processes:
+            pool = multiprocessing.Pool(workers)
+            tasks = [(self.path, self.dtype == numpy.float32, self.channel_index,
+                      self.decimation, all_channels, starts[lo:hi], blocksize,
+                      n_skip, features, prev_start, segment_active)
+                     for lo, hi, prev_start, segment_active in segments]
+            run = lambda: pool.map(_process_features_at, tasks, chunksize=1)
+        else:
+            pool = multiprocessing.pool.ThreadPool(workers)
+            window = self._window(blocksize)
+            run = lambda: pool.map(lambda segment: _features_at(
+                data, starts[segment[0]:segment[1]], blocksize,
+                window, n_skip, self.sample_rate, features,
+                frames_per_batch, self.instrumentation, segment[2],
+                segment[3]), segments, chunksize=1)
+        try:
+            segment_values = run()
+        finally:
+            pool.close()
+            pool.join()
+        for (lo, hi, prev_start, segment_active), values in zip(segments,
+                                                                segment_values):
+            for name in features:
+                result[name][lo:hi] = values[name].T
+        return result
+
+    def pitch_features(self, blocksize=1024, overlap=.50, workers=None,
+                       processes=False, gate=None, all_channels=False):
+        """Compute pitch, goodness-of-pitch, and entropy of whole sound file.
+
+        Gives the same values as calling power_spectrum() and cepstrum() for
+        each frame - see song_features().
+
+        Args:
+            blocksize (int): FFT blocksize
+            overlap (float): frame overlap as a fraction - .25 is 25%
+            workers, processes, gate, all_channels: see song_features()
+
+        Returns:
+            (time, pitch, goodness, entropy) - numpy arrays, time is the
+            center of each frame in seconds. NaN for frames gated as silent.
+            With all_channels, pitch, goodness and entropy are channels by
+            frames.
+        """
+        result = self.song_features(blocksize, overlap,
+                                    ('pitch', 'goodness', 'entropy'),
+                                    workers, processes, gate, all_channels)
+        return tuple(numpy.ascontiguousarray(result[name].T)
+                     for name in ('time', 'pitch', 'goodness', 'entropy'))
+
+    def sweep(self, blocksizes=(1024,), overlaps=(.50,), thresholds=(.25,),
+              max_pitch_freqs=None):
+        """Run goodness_of_pitch() for every combination of parameters, at
+        close to the cost of one run per blocksize.
+
+        For each blocksize, the frames of all the overlaps are analyzed
+        together, so a frame shared by several overlaps (e.g. every frame of
+        50% overlap is also a frame of 75% overlap) gets one FFT and one
+        cepstrum. Only the search for the cepstrum peak is repeated for each
+        max_pitch_freq, and only find_stacks() for each threshold. Results
+        are the same as separate runs.
+
+        Args:
+            blocksizes (sequence of int): FFT blocksizes
+            overlaps (sequence of float): frame overlaps as fractions
+            thresholds (sequence of float): relative goodness thresholds,
+                0 or None for no stacks
+            max_pitch_freqs (sequence of float): max pitch freqs, default is
+                the one this SignalLab was opened with
+
+        Returns:
+            dict of (blocksize, overlap, max_pitch_freq, threshold): SweepPoint
+        """
+        if max_pitch_freqs is None:
+            max_pitch_freqs = (self.max_pitch_freq,)
+        n_skips = [_n_cepstrum_points_to_skip(self.sample_rate, max_pitch_freq)
+                   for max_pitch_freq in max_pitch_freqs]
+        results = {}
+        for blocksize in blocksizes:
+            frame_times = [self._frame_times(blocksize, overlap)
+                           for overlap in overlaps]
+            starts = numpy.unique(numpy.concatenate(
+                [numpy.zeros(0, numpy.intp)] + [s for s, t in frame_times]))
+            pitch = numpy.empty((len(n_skips), len(starts)), self.dtype)
+            goodness = numpy.empty((len(n_skips), len(starts)), self.dtype)
+            entropy = numpy.empty(len(starts), self.dtype)
+            window = self._window(blocksize)
+            work = _WorkBuffers()
+            for lo in range(0, len(starts), self.frames_per_batch):
+                hi = min(lo + self.frames_per_batch, len(starts))
+                with self.instrumentation.stage('framing', hi-lo):
+                    frames = frame_view(self.sound_data, starts[lo:hi], blocksize)
+                values, _ = _frame_features(
+                    frames, window, n_skips, blocksize//2, self.sample_rate,
+                    ('pitch', 'goodness', 'entropy'), self.instrumentation,
+                    work=work)
+                pitch[:, lo:hi] = values['pitch']
+                goodness[:, lo:hi] = values['goodness']
+                entropy[lo:hi] = values['entropy']
+
+            for overlap, (overlap_starts, time) in zip(overlaps, frame_times):
+                rows = numpy.searchsorted(starts, overlap_starts)
+                overlap_entropy = entropy[rows]
+                for i, max_pitch_freq in enumerate(max_pitch_freqs):
+                    overlap_pitch = pitch[i, rows]
+                    overlap_goodness = goodness[i, rows]
+                    for threshold in thresholds:
+                        stacks, goodness_threshold = [], numpy.nan
+                        if threshold:
+                            with self.instrumentation.stage('stacks', len(time)):
+                                stacks, goodness_threshold = find_stacks(
+                                    time, overlap_pitch, overlap_goodness,
+                                    threshold)
+                        results[(blocksize, overlap, max_pitch_freq, threshold)] = \
+                            SweepPoint(time, overlap_pitch, overlap_goodness,
+                                       overlap_entropy, stacks, goodness_threshold)
+        return results
+
     def goodness_of_pitch(self, blocksize=1024, overlap=.50, threshold=.25,
-                          plot_it=True, title=None):
+                          plot_it=True, title=None, workers=None,
+                          processes=False, gate=None, all_channels=False):
         """Compute and optionally plot pitch, goodness-of-pitch, and entropy
         of sound file.
-        """
-        # TODO: verify alg
-        dur_of_N = self.sample_times[blocksize] # how much time N represents
-        end_time = self.sample_times[self.n_wav_samps-1]
-        inc_t = dur_of_N - overlap*dur_of_N
 
-        # Because we may be using overlap, the number of measurements
-        # is not obvious. Since the actual number is small, just use lists.
-        time = []
-        goodness_of_pitch = []
-        entropy = []
-        pitch = []
-
-        offset = 0.0
-        while offset+dur_of_N < end_time:
-            self.power_spectrum(offset_time=offset, blocksize=blocksize,
-                                window_it=True, plot_it=False)
-            good, p = self.cepstrum(blocksize/2, plot_it=False)
-            time.append(offset+0.5*dur_of_N)
-            goodness_of_pitch.append(good)
-            pitch.append(p)
-
-            # entropy
-            am = self.power.mean()
-            gm = numpy.exp( numpy.log(self.power).mean() )
-            entropy.append(gm/am)
-
-            offset += inc_t
+        With workers, segments of the file are analyzed concurrently (see
+        song_features()). Stacks are found after the segments are stitched
+        together, so stacks that span segments come out whole and the list
+        is the same as with no workers.
 
-        stacks = []
-        if threshold:
-            mx_good = max(goodness_of_pitch)
-            mn_good = min(goodness_of_pitch)
-            goodness_threshold = threshold*(mx_good-mn_good) + mn_good
-            # identify periods with goodness-of-pitch above goodness_threshold
-            # these periods are stacked harmonics (stacks for short)
-            stack_pitches = [] # contains pitch values for each stack (temp)
-            for i, good in enumerate(goodness_of_pitch):
-                if good > goodness_threshold:
-                    if stack_pitches:
-                        # still in stacked harmonic
-                        stack_pitches.append(pitch[i])
+        With gate (see song_features()), silent frames are not analyzed and
+        are left out of stacks. With a threshold, the goodness of up to
+        gate_floor_frames of them (spread evenly) is found, for the min
+        goodness the relative threshold is measured from. The goodness
+        threshold is then the same as without the gate if there are no more
+        silent frames than that, and close to it (a little higher) if there
+        are more.
+
+        With all_channels, every channel is analyzed in the same pass (see
+        song_features()), and stacks are found in each channel, with its own
+        goodness threshold.
+
+        Returns:
+            list of stacks (start time, duration, list of pitches) - empty if
+            threshold is 0 or None. With all_channels, a list of them, one
+            per channel.
+        """
+        def compute():
+            time, pitch, goodness, entropy = self.pitch_features(
+                blocksize, overlap, workers, processes, gate, all_channels)
+            stacks, goodness_threshold = [], numpy.full(pitch.shape[:-1], numpy.nan)
+            gated_goodness = numpy.zeros(pitch.shape[:-1] + (0,))
+            if threshold and gate is not None:
+                gated_goodness = self._gated_goodness(blocksize, overlap, goodness,
+                                                      all_channels)
+            if threshold:
+                # identify periods with goodness-of-pitch above goodness_threshold
+                # these periods are stacked harmonics (stacks for short)
+                with self.instrumentation.stage('stacks', pitch.size):
+                    if all_channels:
+                        stacks = []
+                        for index in range(len(pitch)):
+                            channel_stacks, goodness_threshold[index] = find_stacks(
+                                time, pitch[index], goodness[index], threshold,
+                                gated_goodness[index])
+                            stacks.append(channel_stacks)
                     else:
-                        # start of stacked harmonic
-                        start_t = time[i]
-                        stack_pitches.append(pitch[i])
-                else:
-                    # below threshold
-                    if stack_pitches:
-                        # close the stack
-                        dur = time[i] - start_t
-                        stacks.append((start_t, dur, stack_pitches))
-                        stack_pitches = []
-                    # else - below thr, no open stack - nothing to do
-            # what if stack still open (end above thrsh)? close it
-            if stack_pitches:
-                dur = time[-1] - start_t
-                stacks.append((start_t, dur, stack_pitches))
-                stack_pitches = []
+                        stacks, goodness_threshold = find_stacks(
+                            time, pitch, goodness, threshold, gated_goodness)
+            elif all_channels:
+                stacks = [[] for index in range(len(pitch))]
+            return {'time': time, 'pitch': pitch, 'goodness': goodness,
+                    'entropy': entropy,
+                    'goodness_threshold': goodness_threshold,
+                    'stacks': numpy.array(json.dumps(stacks))}
+        params = {'blocksize': blocksize, 'overlap': overlap,
+                  'threshold': threshold, 'max_pitch_freq': self.max_pitch_freq,
+                  'dtype': self.dtype.name} # compact results are float32
+        if gate is not None:
+            params['gate'] = gate
+        if all_channels:
+            params['all_channels'] = True
+        result = self._cached('goodness_of_pitch', params, compute)
+        time = result['time']
+        pitch = result['pitch']
+        goodness_of_pitch = result['goodness']
+        entropy = result['entropy']
+        goodness_threshold = numpy.ravel(result['goodness_threshold'])
+        stacks = json.loads(str(result['stacks']))
+        if all_channels:
+            stacks = [[tuple(stack) for stack in channel_stacks]
+                      for channel_stacks in stacks]
+        else:
+            stacks = [tuple(stack) for stack in stacks]
+        end_time = (self.n_wav_samps-1)*self.delta_t
 
         if plot_it:
-            fig, ax1 = plt.subplots(figsize=(10.0, 4.0), dpi=80)
-            ax1.plot(time, pitch, 'b.')
-            ax1.set_ylabel('pitch', color='b')
-            for tlab in ax1.get_yticklabels():
-                tlab.set_color('b')
+            with self.instrumentation.stage('plotting'):
+                plt = _pyplot()
+                fig, ax1 = plt.subplots(figsize=(10.0, 4.0), dpi=80)
+                ax1.plot(time, pitch.T, 'b.')
+                ax1.set_ylabel('pitch', color='b')
+                for tlab in ax1.get_yticklabels():
+                    tlab.set_color('b')
 
-            plt.grid(True)
+                plt.grid(True)
 
-            ax2 = ax1.twinx()
-            ax2.plot(time, goodness_of_pitch, 'r.-')
-            if threshold:
-                ax2.plot([time[0], time[-1]],
-                         [goodness_threshold, goodness_threshold],
-                         'm--')
-
-            # plot entropy, scale to fit with goodness-of-pitch so easy to see
-            mx_good = max(goodness_of_pitch)
-            mx_entropy = max(entropy)
-            entropy_plot_array = numpy.array(entropy) * mx_good/mx_entropy
-            ax2.plot(time, entropy_plot_array, 'g.-')
-
-            ax2.set_xlabel('Seconds')
-            ax2.set_ylabel('goodness', color='r')
-            for tlab in ax2.get_yticklabels():
-                tlab.set_color('r')
-            ax2.set_xlim([0.0, end_time*1.01])
+                ax2 = ax1.twinx()
+                ax2.plot(time, goodness_of_pitch.T, 'r.-')
+                if threshold:
+                    for channel_threshold in goodness_threshold:
+                        ax2.plot([time[0], time[-1]],
+                                 [channel_threshold, channel_threshold], 'm--')
 
-            if title is None:
-                title = 'Goodness of pitch (entropy in green)'
-            plt.title(title)
+                # plot entropy, scale to fit with goodness-of-pitch so easy to see
+                mx_good = numpy.nanmax(goodness_of_pitch)
+                mx_entropy = numpy.nanmax(entropy)
+                entropy_plot_array = entropy * mx_good/mx_entropy
+                ax2.plot(time, entropy_plot_array.T, 'g.-')
+
+                ax2.set_xlabel('Seconds')
+                ax2.set_ylabel('goodness', color='r')
+                for tlab in ax2.get_yticklabels():
+                    tlab.set_color('r')
+                ax2.set_xlim([0.0, end_time*1.01])
+
+                if title is None:
+                    title = 'Goodness of pitch (entropy in green)'
+                plt.title(title)
 
         return stacks
 
+class PitchStream(object):
+    """Goodness-of-pitch analysis of sound that arrives in chunks.
+
+    Streaming counterpart of SignalLab.goodness_of_pitch(). Pass samples to
+    feed() as they arrive; only the part of the last frame not yet analyzed
+    is kept between calls, so memory use does not grow with the length of
+    the recording. Frames are chosen the same way as goodness_of_pitch()
+    chooses them.
+
+    The stack threshold is absolute, since the min and max goodness of the
+    whole recording are not known while it is streaming. A good value can
+    be found with goodness_of_pitch() on a typical file - it returns the
+    absolute threshold it used via find_stacks().
+
+    Attributes:
+        sample_rate (float): sample rate in Hz
+        blocksize (int): FFT blocksize
+        goodness_threshold (float): absolute threshold for stacks, or None
+            to not look for stacks
+        max_pitch_freq (float): actual max pitch freq (see SignalLab)
+        instrumentation (Instrumentation): per-stage counters and timers
+    """
+
+    frames_per_batch = SignalLab.frames_per_batch
+
+    def __init__(self, sample_rate, goodness_threshold=None, blocksize=1024,
+                 overlap=.50, max_pitch_freq=4.2e3, instrumentation=None):
+        self.sample_rate = float(sample_rate)
+        self.instrumentation = instrumentation or _NO_INSTRUMENTATION
+        self.blocksize = blocksize
+        self.goodness_threshold = goodness_threshold
+        self._n_skip = _n_cepstrum_points_to_skip(self.sample_rate, max_pitch_freq)
+        self.max_pitch_freq = self.sample_rate/self._n_skip
+        self._window = hann_window(blocksize)
+        self._work = _WorkBuffers() # reused by every feed()
+        self._delta_t = 1.0/self.sample_rate
+        self._dur_of_N = blocksize*self._delta_t
+        self._inc_t = self._dur_of_N - overlap*self._dur_of_N
+        if self._inc_t <= 0.0:
+            raise ValueError('overlap must be less than 1.0, got {}'.format(overlap))
+        self._offset = 0.0        # offset of next frame, in seconds
+        self._buffer = numpy.zeros(0, dtype=numpy.int16) # samples not yet used
+        self._buffer_start = 0    # index of first sample in _buffer
+        self._tracker = StackTracker()
+
+    def feed(self, samples):
+        """Analyze every frame completed by samples.
+
+        Args:
+            samples (numpy array): next samples of the sound
+
+        Returns:
+            ((time, pitch, goodness, entropy), stacks) - numpy arrays for the
+            frames completed by samples (may be empty), and list of stacks
+            that ended in those frames
+        """
+        self._buffer = numpy.concatenate((self._buffer, samples))
+        end_i = self._buffer_start + len(self._buffer)
+
+        # offsets are accumulated, and frames end before the time of the
+        # last sample so far, as in SignalLab._frame_times() - a frame that
+        # does so now does so for any longer sound
+        n_max = int(len(self._buffer)/(self._inc_t*self.sample_rate)) + 2
+        offsets = numpy.concatenate(([self._offset],
+                                     numpy.full(n_max, self._inc_t))).cumsum()
+        starts = (0.5 + offsets*self.sample_rate).astype(numpy.intp)
+        end_time = (end_i-1)*self._delta_t
+        n_frames = numpy.count_nonzero(offsets + self._dur_of_N < end_time)
+        self._offset = offsets[n_frames]
+        time = offsets[:n_frames] + 0.5*self._dur_of_N
+        starts = starts[:n_frames] - self._buffer_start
+
+        pitch = numpy.empty(n_frames)
+        goodness = numpy.empty(n_frames)
+        entropy = numpy.empty(n_frames)
+        for lo in range(0, n_frames, self.frames_per_batch):
+            hi = min(lo + self.frames_per_batch, n_frames)
+            with self.instrumentation.stage('framing', hi-lo):
+                frames = frame_view(self._buffer, starts[lo:hi], self.blocksize)
+            values, _ = _frame_features(
+                frames, self._window, self._n_skip, self.blocksize//2,
+                self.sample_rate, ('pitch', 'goodness', 'entropy'),
+                self.instrumentation, work=self._work)
+            pitch[lo:hi] = values['pitch']
+            goodness[lo:hi] = values['goodness']
+            entropy[lo:hi] = values['entropy']
+
+        # drop samples before the next frame
+        next_i = int(0.5 + self._offset*self.sample_rate)
+        self._buffer = self._buffer[next_i - self._buffer_start:].copy()
+        self._buffer_start = next_i
+
+        stacks = []
+        if self.goodness_threshold is not None:
+            with self.instrumentation.stage('stacks', n_frames):
+                stacks = self._tracker.update(time, pitch, goodness,
+                                              self.goodness_threshold)
+        return (time, pitch, goodness, entropy), stacks
+
+    def flush(self):
+        """End of sound. Returns list of stacks still open (empty or one stack).
+
+        Samples after the last complete frame are not analyzed.
+        """
+        self._buffer = self._buffer[:0]
+        return self._tracker.close()
+
+def _int16_chunks(source, chunk_size):
+    """Yield int16 numpy arrays of up to chunk_size samples from source.
+
+    See stream_pitch() for the kinds of source.
+    """
+    if callable(source):
+        while True:
+            chunk = source()
+            if chunk is None or len(chunk) == 0:
+                return
+            if isinstance(chunk, bytes):
+                chunk = numpy.frombuffer(chunk, dtype='<i2')
+            yield chunk
+    read = source.readframes if hasattr(source, 'readframes') else \
+           lambda n: source.read(2*n)
+    leftover = b'' # odd byte from a pipe read
+    while True:
+        stream = read(chunk_size)
+        if not stream:
+            return
+        stream = leftover + stream
+        n_bytes = len(stream) - len(stream) % 2
+        leftover = stream[n_bytes:]
+        yield numpy.frombuffer(stream[:n_bytes], dtype='<i2')
+
+def stream_pitch(source, sample_rate=None, chunk_size=65536, **kwargs):
+    """Generator - goodness-of-pitch analysis of a sound, a chunk at a time.
+
+    Args:
+        source: one of
+            path (str) of a 16-bit mono wav file,
+            open wave file (from wave.open()),
+            file-like object (e.g. a pipe) with raw 16-bit little-endian samples,
+            callable returning the next chunk of samples (numpy array or raw
+            bytes), or None or an empty chunk at end of sound
+        sample_rate (float): sample rate in Hz - not needed for wav files
+        chunk_size (int): number of samples to read at a time (not used for
+            callable)
+        **kwargs: passed on to PitchStream (goodness_threshold, blocksize,
+            overlap, max_pitch_freq, instrumentation)
+
+    Yields:
+        ((time, pitch, goodness, entropy), stacks) for each chunk, as
+        returned by PitchStream.feed(). The final yield has no frames and the
+        stack (if any) still open at the end of the sound.
+    """
+    snd = None
+    if isinstance(source, str):
+        source = snd = wave.open(source, 'r')
+    try:
+        if hasattr(source, 'getframerate'):
+            if source.getsampwidth() != 2 or source.getnchannels() != 1:
+                raise TypeError('Expecting 16-bit mono wav file.')
+            sample_rate = source.getframerate()
+        if sample_rate is None:
+            raise ValueError('sample_rate is required for this source')
+        analyzer = PitchStream(sample_rate, **kwargs)
+        for chunk in _int16_chunks(source, chunk_size):
+            yield analyzer.feed(chunk)
+        empty = numpy.zeros(0)
+        yield (empty, empty, empty, empty), analyzer.flush()
+    finally:
+        if snd is not None:
+            snd.close()
+
 if __name__ == '__main__':
     # Example of how to use SignalLab.
     #
@@ -377,4 +2068,5 @@ if __name__ == '__main__':
         print('stack start time: {0:.3f} dur: {1:.3f} pitches: {2}'.format(
             stack[0], stack[1], stack[2]))
     signal_data.plot_spectrogram(max_freq=10e3)
+    import matplotlib.pyplot as plt
     plt.show() # shows plots and waits for user to close them all
@@ -2,3 +2,589 @@
 
 # this file is ONLY wx GUI code to host signal_lab
 
+"""Scrolling, zooming viewer of the envelope and spectrogram of a sound file.
+
+The view is drawn from tiles TILE_WIDTH pixels wide, each showing the
+envelope (top) and spectrogram (below) of the samples under it at one zoom
+level. Tiles are rendered by a background thread - visible tiles first, then
+the tiles a screen to either side - and kept in an LRU cache of bitmaps.
+Scrolling shifts what is already drawn with a blit and draws only the newly
+exposed columns, so only tiles that have never been seen cost anything.
+
+Clicking selects a time and shows the power spectrum, cepstrum, and pitch of
+the frame there, from SignalLab's frame caches.
+
+Example:
+    python signal_lab_wx.py motif.wav
+"""
+
+import sys
+import threading
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+import numpy
+import wx
+
+import signal_lab
+
+TILE_WIDTH = 256 # pixels
+
+BACKGROUND = (32, 32, 32)
+ENVELOPE_COLOR = (0, 200, 90)
+CURSOR_COLOR = (255, 255, 255)
+
+def _colormap(n=256):
+    """Return n by 3 uint8 array of colors, black through blue, red and
+    yellow to white."""
+    anchors = numpy.array([[0, 0, 0], [0, 0, 160], [200, 0, 120],
+                           [255, 160, 0], [255, 255, 255]], dtype=float)
+    x = numpy.linspace(0, len(anchors)-1, n)
+    return numpy.column_stack([numpy.interp(x, numpy.arange(len(anchors)),
+                                            anchors[:, c])
+                               for c in range(3)]).astype(numpy.uint8)
+
+COLORMAP = _colormap()
+
+def column_envelope(data, envelope, first_column, samples_per_pixel, width):
+    """Return (mins, maxs) of the samples under each of width pixel columns.
+
+    Read from the coarsest level of envelope (an EnvelopePyramid) whose
+    buckets evenly divide samples_per_pixel, or from data itself when zoomed
+    in past level 0, so long files are not read sample by sample. Columns
+    past the end of data are NaN.
+    """
+    size, mins, maxs = 1, data, data
+    level_size = envelope.base
+    for level_mins, level_maxs in envelope.levels:
+        if level_size > samples_per_pixel or samples_per_pixel % level_size:
+            break
+        size, mins, maxs = level_size, level_mins, level_maxs
+        level_size *= envelope.factor
+    per_column = samples_per_pixel // size
+    lo = first_column*per_column
+    n = max(0, min(width*per_column, len(mins) - lo))
+    out_mins = numpy.full(width, numpy.nan)
+    out_maxs = numpy.full(width, numpy.nan)
+    if n:
+        n_columns = -(-n // per_column) # ceil
+        pad = n_columns*per_column - n # last column may be partial
+        col_mins = numpy.asarray(mins[lo:lo+n], dtype=float)
+        col_maxs = numpy.asarray(maxs[lo:lo+n], dtype=float)
+        if pad:
+            col_mins = numpy.append(col_mins, numpy.repeat(col_mins[-1], pad))
+            col_maxs = numpy.append(col_maxs, numpy.repeat(col_maxs[-1], pad))
+        out_mins[:n_columns] = col_mins.reshape(n_columns, per_column).min(axis=1)
+        out_maxs[:n_columns] = col_maxs.reshape(n_columns, per_column).max(axis=1)
+    return out_mins, out_maxs
+
+class TileRenderer(threading.Thread):
+    """Background thread that renders tiles of one sound file.
+
+    A tile key is (samples_per_pixel, tile index, height). Requested tiles
+    are rendered in order of priority (then newest first) and passed, as
+    height by TILE_WIDTH by 3 uint8 RGB arrays, to callback(key, image) on
+    the GUI thread. Requests made before the last cancel() are dropped.
+
+    The thread opens its own memory-mapped SignalLab, so it shares no caches
+    with the GUI thread.
+
+    Attributes:
+        blocksize (int): FFT blocksize of spectrogram
+        max_freq (float): top of spectrogram in Hz
+        envelope_height (int): pixels of envelope at top of each tile
+        dynamic_range_db (float): dB below the loudest possible tone that
+            are shown in the spectrogram (quieter is black)
+        save_envelope (bool): if True, save the envelope pyramid next to the
+            sound file (see SignalLab.envelope_pyramid()) so it loads faster
+            next time
+    """
+
+    def __init__(self, path, callback, blocksize=512, max_freq=10e3,
+                 envelope_height=80, dynamic_range_db=90.0, save_envelope=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.callback = callback
+        self.save_envelope = save_envelope
+        self.blocksize = blocksize
+        self.envelope_height = envelope_height
+        self.dynamic_range_db = dynamic_range_db
+        self._requests = queue.PriorityQueue()
+        self._n_requests = 0
+        self._generation = 0
+        self._data = signal_lab.SignalLab(path, mmap=True, compact=True)
+        self.max_freq = min(max_freq, self._data.sample_rate/2.0)
+        self._window = signal_lab.hann_window(blocksize, numpy.float32)
+        self._envelope = None # built on first render, in this thread
+        self._peak = None
+        self._bins = {} # FFT bin of each spectrogram row, by number of rows
+
+    def request(self, key, priority=0):
+        """Queue tile key for rendering - lower priority is rendered first."""
+        self._n_requests += 1
+        self._requests.put((priority, -self._n_requests, self._generation, key))
+
+    def cancel(self):
+        """Drop all requests made so far."""
+        self._generation += 1
+
+    def stop(self):
+        """End the thread once it finishes the tile it is rendering."""
+        self.cancel()
+        self._requests.put((-1, 0, self._generation, None))
+
+    def run(self):
+        while True:
+            priority, order, generation, key = self._requests.get()
+            if key is None:
+                return
+            if generation == self._generation:
+                wx.CallAfter(self.callback, key, self.render(key))
+
+    def _prepare(self):
+        """Load or build the envelope pyramid (saved if save_envelope)."""
+        try:
+            self._envelope = self._data.envelope_pyramid(save=self.save_envelope)
+        except (IOError, OSError): # can't write next to sound file
+            self._envelope = self._data.envelope_pyramid()
+        peaks = [abs(float(a.min())) for a in self._envelope.levels[-1] if len(a)]
+        peaks += [abs(float(a.max())) for a in self._envelope.levels[-1] if len(a)]
+        self._peak = max(peaks + [1.0])
+
+    def _column_power(self, first_column, samples_per_pixel, bins):
+        """Return power (TILE_WIDTH by len(bins)) of the frame centered on
+        each pixel column, and bool array of columns within the file.
+
+        When zoomed out past one frame per blocksize samples, frames are
+        spaced apart and the samples between them are skipped.
+        """
+        data = self._data.sound_data
+        centers = (numpy.arange(first_column, first_column+TILE_WIDTH) + 0.5) * \
+                  samples_per_pixel
+        starts = centers.astype(numpy.intp) - self.blocksize//2
+        inside = (starts >= 0) & (starts + self.blocksize <= len(data))
+        frames = numpy.zeros((TILE_WIDTH, self.blocksize), numpy.float32)
+        if inside.any():
+            frames[inside] = signal_lab.frame_view(data, starts[inside],
+                                                   self.blocksize)
+        frames *= self._window
+        spectrum = numpy.fft.rfft(frames, axis=1)[:, bins]
+        power = spectrum.real**2
+        power += spectrum.imag**2
+        return power, centers < len(data)
+
+    def render(self, key):
+        """Return RGB image of tile key - see TileRenderer."""
+        if self._envelope is None:
+            self._prepare()
+        samples_per_pixel, index, height = key
+        first_column = index*TILE_WIDTH
+        image = numpy.empty((height, TILE_WIDTH, 3), numpy.uint8)
+        image[:] = BACKGROUND
+
+        # envelope, full scale is the peak of the file
+        env_height = min(self.envelope_height, height)
+        mins, maxs = column_envelope(self._data.sound_data, self._envelope,
+                                     first_column, samples_per_pixel, TILE_WIDTH)
+        mid = 0.5*(env_height-1)
+        rows = numpy.arange(env_height)[:, None]
+        with numpy.errstate(invalid='ignore'): # NaN past end of file
+            inside = (rows >= numpy.floor(mid - maxs/self._peak*mid)) & \
+                     (rows <= numpy.ceil(mid - mins/self._peak*mid))
+        image[:env_height][inside] = ENVELOPE_COLOR
+
+        # spectrogram, high frequencies at top
+        spec_top = env_height + 1
+        spec_height = height - spec_top
+        if spec_height > 0:
+            bins = self._bins.get(spec_height)
+            if bins is None:
+                freqs = numpy.linspace(self.max_freq, 0.0, spec_height)
+                bins = self._bins[spec_height] = numpy.minimum(
+                    (0.5 + freqs*self.blocksize/self._data.sample_rate).astype(int),
+                    self.blocksize//2)
+            power, in_file = self._column_power(first_column, samples_per_pixel,
+                                                bins)
+            top_db = 20.0*numpy.log10(self._peak*self.blocksize/4.0) # loudest tone
+            level = 10.0*numpy.log10(power + 1e-12)
+            level -= top_db - self.dynamic_range_db
+            level *= (len(COLORMAP)-1)/self.dynamic_range_db
+            colors = COLORMAP[numpy.clip(level, 0, len(COLORMAP)-1).astype(int)]
+            colors[~in_file] = BACKGROUND
+            image[spec_top:] = colors.transpose(1, 0, 2)
+        return image
+
+class TileCache(signal_lab.LRUCache):
+    """LRUCache of tile bitmaps, filled by put() as tiles arrive."""
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def peek(self, key):
+        """Return cached tile (now most recently used), or None."""
+        value = self._data.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data[key] = value
+        return value
+
+    def put(self, key, value):
+        self._data.pop(key, None)
+        if len(self._data) >= self.maxsize:
+            self._data.popitem(last=False) # least recently used
+        self._data[key] = value
+
+class TrackPanel(wx.Panel):
+    """Envelope over spectrogram of a sound file, drawn from tiles.
+
+    Mouse wheel scrolls, ctrl+wheel (or + and -) zooms about the pointer,
+    arrow keys scroll, Home and End jump to the ends, and a click selects
+    a time.
+
+    Attributes:
+        data (SignalLab): the sound file, memory-mapped
+        samples_per_pixel (int): zoom - always a power of 2
+        x0 (int): pixel column (at this zoom) at left edge of panel
+        selected_i (int): sample index of selected time, or None
+        on_select: called with time in seconds when a time is selected
+        on_view_changed: called with no args after a scroll or zoom
+        tile_cache_size (int): number of tile bitmaps cached
+        prefetch_screens (int): screens of tiles to each side rendered ahead
+    """
+
+    tile_cache_size = 256
+    prefetch_screens = 1
+
+    def __init__(self, parent, path, blocksize=512, max_freq=10e3,
+                 envelope_height=80, save_envelope=False):
+        wx.Panel.__init__(self, parent, style=wx.WANTS_CHARS)
+        self.SetBackgroundStyle(wx.BG_STYLE_PAINT)
+        self.data = signal_lab.SignalLab(path, mmap=True)
+        self.samples_per_pixel = 1
+        self.x0 = 0
+        self.selected_i = None
+        self.on_select = None
+        self.on_view_changed = None
+        self._tiles = TileCache(self.tile_cache_size)
+        self._pending = set() # keys requested but not yet rendered
+        self._renderer = TileRenderer(path, self._tile_done, blocksize, max_freq,
+                                      envelope_height,
+                                      save_envelope=save_envelope)
+        self._renderer.start()
+        self._buffer = self._back = None
+        self.Bind(wx.EVT_PAINT, self._on_paint)
+        self.Bind(wx.EVT_SIZE, self._on_size)
+        self.Bind(wx.EVT_MOUSEWHEEL, self._on_wheel)
+        self.Bind(wx.EVT_LEFT_DOWN, self._on_click)
+        self.Bind(wx.EVT_KEY_DOWN, self._on_key)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self._on_destroy)
+
+    def n_columns(self):
+        """Return number of pixel columns of whole file at this zoom."""
+        return -(-self.data.n_wav_samps // self.samples_per_pixel)
+
+    def _max_samples_per_pixel(self):
+        """Zoom at which the whole file fits in the panel."""
+        width = max(1, self.GetClientSize()[0])
+        spp = 1
+        while -(-self.data.n_wav_samps // spp) > width:
+            spp *= 2
+        return spp
+
+    def _key(self, index):
+        return (self.samples_per_pixel, index, self.GetClientSize()[1])
+
+    def _request(self, index, priority):
+        key = self._key(index)
+        if key not in self._pending and key not in self._tiles:
+            self._pending.add(key)
+            self._renderer.request(key, priority)
+
+    def _draw_columns(self, lo, hi):
+        """Draw panel columns lo up to hi into the buffer, from cached tiles,
+        requesting tiles that aren't cached."""
+        width, height = self.GetClientSize()
+        dc = wx.MemoryDC(self._buffer)
+        dc.SetPen(wx.TRANSPARENT_PEN)
+        dc.SetBrush(wx.Brush(wx.Colour(*BACKGROUND)))
+        dc.DrawRectangle(lo, 0, hi-lo, height)
+        dc.SetClippingRegion(lo, 0, hi-lo, height)
+        n_tiles = -(-self.n_columns() // TILE_WIDTH)
+        first = (self.x0 + lo) // TILE_WIDTH
+        last = min((self.x0 + hi - 1) // TILE_WIDTH, n_tiles - 1)
+        for index in range(first, last+1):
+            tile = self._tiles.peek(self._key(index))
+            if tile is None:
+                self._request(index, 0)
+            else:
+                dc.DrawBitmap(tile, index*TILE_WIDTH - self.x0, 0)
+        dc.DestroyClippingRegion()
+        dc.SelectObject(wx.NullBitmap)
+
+        # render ahead, so scrolling finds tiles ready
+        margin = self.prefetch_screens*width
+        for index in range(max(0, (self.x0 - margin) // TILE_WIDTH),
+                           min(n_tiles, (self.x0 + width + margin) // TILE_WIDTH + 1)):
+            self._request(index, 1)
+
+    def _tile_done(self, key, image):
+        """Called on GUI thread with each tile from the renderer."""
+        if not self:
+            return # panel destroyed
+        self._pending.discard(key)
+        spp, index, height = key
+        self._tiles.put(key, wx.Bitmap.FromBuffer(TILE_WIDTH, height,
+                                                  image.tobytes()))
+        if key == self._key(index) and self._buffer is not None:
+            width = self.GetClientSize()[0]
+            lo = max(0, index*TILE_WIDTH - self.x0)
+            hi = min(width, (index+1)*TILE_WIDTH - self.x0)
+            if lo < hi:
+                self._draw_columns(lo, hi)
+                self.RefreshRect(wx.Rect(lo, 0, hi-lo, height), False)
+
+    def redraw(self):
+        """Drop pending tile requests and draw whole panel."""
+        self._renderer.cancel()
+        self._pending.clear()
+        width = self.GetClientSize()[0]
+        if self._buffer is not None and width > 0:
+            self._draw_columns(0, width)
+        self.Refresh(False)
+        self._view_changed()
+
+    def _view_changed(self):
+        if self.on_view_changed is not None:
+            self.on_view_changed()
+
+    def _clamp(self, x0):
+        width = self.GetClientSize()[0]
+        return int(max(0, min(x0, self.n_columns() - width)))
+
+    def scroll_to(self, x0):
+        """Scroll so pixel column x0 is at left edge of panel.
+
+        What is already drawn is shifted by a blit; only the newly exposed
+        columns are drawn.
+        """
+        x0 = self._clamp(x0)
+        dx = x0 - self.x0
+        if dx == 0 or self._buffer is None:
+            return
+        self.x0 = x0
+        width, height = self.GetClientSize()
+        if abs(dx) >= width:
+            self._draw_columns(0, width)
+        else:
+            dc = wx.MemoryDC(self._back)
+            dc.DrawBitmap(self._buffer, -dx, 0)
+            dc.SelectObject(wx.NullBitmap)
+            self._buffer, self._back = self._back, self._buffer
+            if dx > 0:
+                self._draw_columns(width - dx, width)
+            else:
+                self._draw_columns(0, -dx)
+        self.Refresh(False)
+        self._view_changed()
+
+    def zoom(self, factor, about=None):
+        """Zoom in (factor 2) or out (factor 0.5), keeping the time at panel
+        column about (default center) in place."""
+        width = self.GetClientSize()[0]
+        if about is None:
+            about = width // 2
+        spp = self.samples_per_pixel
+        new_spp = spp//2 if factor > 1 else spp*2
+        new_spp = max(1, min(new_spp, self._max_samples_per_pixel()))
+        if new_spp == spp:
+            return
+        sample_i = (self.x0 + about)*spp
+        self.samples_per_pixel = new_spp
+        self.x0 = self._clamp(sample_i//new_spp - about)
+        self.redraw()
+
+    def _on_size(self, event):
+        width, height = self.GetClientSize()
+        if width > 0 and height > 0:
+            self._buffer = wx.Bitmap(width, height)
+            self._back = wx.Bitmap(width, height)
+            self._tiles.clear() # tiles are the old height
+            self.samples_per_pixel = min(self.samples_per_pixel,
+                                         self._max_samples_per_pixel())
+            self.x0 = self._clamp(self.x0)
+            self.redraw()
+        event.Skip()
+
+    def _on_paint(self, event):
+        dc = wx.PaintDC(self)
+        if self._buffer is None:
+            return
+        dc.DrawBitmap(self._buffer, 0, 0)
+        if self.selected_i is not None:
+            x = self.selected_i // self.samples_per_pixel - self.x0
+            dc.SetPen(wx.Pen(wx.Colour(*CURSOR_COLOR)))
+            dc.DrawLine(x, 0, x, self.GetClientSize()[1])
+
+    def _on_wheel(self, event):
+        steps = event.GetWheelRotation() / float(event.GetWheelDelta() or 1)
+        if event.ControlDown():
+            self.zoom(2 if steps > 0 else 0.5, event.GetX())
+        else:
+            self.scroll_to(self.x0 - int(steps*self.GetClientSize()[0]/8))
+
+    def _on_click(self, event):
+        self.SetFocus()
+        sample_i = (self.x0 + event.GetX())*self.samples_per_pixel + \
+                   self.samples_per_pixel//2
+        if sample_i < self.data.n_wav_samps:
+            self.selected_i = sample_i
+            self.Refresh(False)
+            if self.on_select is not None:
+                self.on_select(sample_i*self.data.delta_t)
+
+    def _on_key(self, event):
+        code = event.GetKeyCode()
+        width = self.GetClientSize()[0]
+        if code in (ord('+'), ord('='), wx.WXK_NUMPAD_ADD):
+            self.zoom(2)
+        elif code in (ord('-'), wx.WXK_NUMPAD_SUBTRACT):
+            self.zoom(0.5)
+        elif code == wx.WXK_LEFT:
+            self.scroll_to(self.x0 - width//8)
+        elif code == wx.WXK_RIGHT:
+            self.scroll_to(self.x0 + width//8)
+        elif code == wx.WXK_PAGEUP:
+            self.scroll_to(self.x0 - width)
+        elif code == wx.WXK_PAGEDOWN:
+            self.scroll_to(self.x0 + width)
+        elif code == wx.WXK_HOME:
+            self.scroll_to(0)
+        elif code == wx.WXK_END:
+            self.scroll_to(self.n_columns())
+        else:
+            event.Skip()
+
+    def _on_destroy(self, event):
+        self._renderer.stop()
+        event.Skip()
+
+class FramePanel(wx.Panel):
+    """Power spectrum (left) and cepstrum (right) of one frame, with its
+    pitch and goodness-of-pitch."""
+
+    def __init__(self, parent, blocksize=1024, max_freq=10e3):
+        wx.Panel.__init__(self, parent)
+        self.SetBackgroundStyle(wx.BG_STYLE_PAINT)
+        self.blocksize = blocksize
+        self.max_freq = max_freq
+        self._shown = None # (time, power dB, cepstrum, pitch, goodness)
+        self.Bind(wx.EVT_PAINT, self._on_paint)
+        self.Bind(wx.EVT_SIZE, lambda event: self.Refresh(False))
+
+    def show(self, data, time):
+        """Show frame of data (a SignalLab) centered at time in seconds.
+
+        The spectrum and cepstrum come from data's frame caches, so showing
+        a frame again costs nothing.
+        """
+        if data.n_wav_samps < self.blocksize:
+            return
+        offset_i = int(0.5 + time*data.sample_rate) - self.blocksize//2
+        offset_i = max(0, min(offset_i, data.n_wav_samps - self.blocksize))
+        frame = data.frame(offset_i*data.delta_t, self.blocksize)
+        n_freqs = min(self.blocksize//2 + 1,
+                      int(self.max_freq*self.blocksize/data.sample_rate) + 1)
+        power_db = 10.0*numpy.log10(data.frame_power(frame)[:n_freqs] + 1e-12)
+        cepstrum = numpy.array(data.frame_cepstrum(frame)[:self.blocksize//2])
+        cepstrum[0] = 0 # zero-shift point would swamp the scale
+        goodness, pitch = data.cepstrum(self.blocksize//2, plot_it=False,
+                                        frame=frame)
+        self._shown = (time, power_db, cepstrum, data.sample_rate/pitch,
+                       pitch, goodness)
+        self.Refresh(False)
+
+    @staticmethod
+    def _draw_curve(dc, y, rect):
+        """Draw y (numpy array) scaled to fill rect (x, y, width, height)."""
+        x0, y0, width, height = rect
+        lo, hi = float(y.min()), float(y.max())
+        xs = x0 + numpy.linspace(0, width-1, len(y))
+        ys = y0 + (height-1)*(hi - y)/((hi - lo) or 1.0)
+        dc.DrawLines([(int(x), int(y_)) for x, y_ in zip(xs, ys)])
+
+    def _on_paint(self, event):
+        dc = wx.PaintDC(self)
+        dc.SetBackground(wx.Brush(wx.Colour(*BACKGROUND)))
+        dc.Clear()
+        if self._shown is None:
+            return
+        time, power_db, cepstrum, pitch_i, pitch, goodness = self._shown
+        width, height = self.GetClientSize()
+        half = width // 2
+        text_height = dc.GetTextExtent('Hz')[1] + 4
+        plot_height = max(1, height - text_height)
+        dc.SetTextForeground(wx.Colour(*CURSOR_COLOR))
+        dc.DrawText('spectrum {:.3f} sec (0 to {:.0f} Hz)'.format(
+            time, self.max_freq), 4, 2)
+        dc.DrawText('cepstrum  pitch {:.0f} Hz  goodness {:.3g}'.format(
+            pitch, goodness), half + 4, 2)
+        dc.SetPen(wx.Pen(wx.Colour(*ENVELOPE_COLOR)))
+        self._draw_curve(dc, power_db, (0, text_height, half - 4, plot_height))
+        self._draw_curve(dc, cepstrum, (half + 4, text_height, width - half - 4,
+                                        plot_height))
+        # mark the cepstrum peak the pitch comes from
+        x = half + 4 + int(pitch_i*(width - half - 5)/(len(cepstrum) - 1))
+        dc.SetPen(wx.Pen(wx.Colour(*CURSOR_COLOR), style=wx.PENSTYLE_SHORT_DASH))
+        dc.DrawLine(x, text_height, x, height)
+
+class ViewerFrame(wx.Frame):
+    """Top level window: TrackPanel, its scroll bar, and a FramePanel for the
+    selected time."""
+
+    def __init__(self, path, blocksize=512, max_freq=10e3, save_envelope=False):
+        wx.Frame.__init__(self, None, title=path, size=(1000, 700))
+        self.track = TrackPanel(self, path, blocksize, max_freq,
+                                save_envelope=save_envelope)
+        self.scroll_bar = wx.ScrollBar(self, style=wx.SB_HORIZONTAL)
+        self.frame_panel = FramePanel(self, max_freq=max_freq)
+        self.CreateStatusBar()
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.track, 3, wx.EXPAND)
+        sizer.Add(self.scroll_bar, 0, wx.EXPAND)
+        sizer.Add(self.frame_panel, 1, wx.EXPAND)
+        self.SetSizer(sizer)
+        self.track.on_view_changed = self._view_changed
+        self.track.on_select = lambda time: self.frame_panel.show(self.track.data,
+                                                                  time)
+        self.scroll_bar.Bind(wx.EVT_SCROLL,
+                             lambda event: self.track.scroll_to(event.GetPosition()))
+
+    def _view_changed(self):
+        track = self.track
+        width = track.GetClientSize()[0]
+        self.scroll_bar.SetScrollbar(track.x0, width, track.n_columns(), width)
+        delta_t = track.data.delta_t
+        self.SetStatusText('{:.3f} to {:.3f} sec, {} samples per pixel'.format(
+            track.x0*track.samples_per_pixel*delta_t,
+            (track.x0 + width)*track.samples_per_pixel*delta_t,
+            track.samples_per_pixel))
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    app = wx.App(False)
+    if argv:
+        path = argv[0]
+    else:
+        path = wx.FileSelector('Open sound file', wildcard='*.wav')
+        if not path:
+            return
+    frame = ViewerFrame(path)
+    frame.Show()
+    app.MainLoop()
+
+if __name__ == '__main__':
+    main()
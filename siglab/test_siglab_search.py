@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+"""Regression checks of siglab_search.FingerprintIndex.
+
+Run with:
+    python -m unittest test_siglab_search
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import siglab_bench
+import siglab_search
+
+class FingerprintIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.long_path = os.path.join(self.directory, 'long.wav')
+        self.short_path = os.path.join(self.directory, 'short.wav')
+        siglab_bench.make_stack_wav(self.long_path, duration=2.0)
+        # fewer frames than window_frames, so no summaries
+        siglab_bench.make_noise_wav(self.short_path, duration=4000/44100.0)
+        self.index = siglab_search.FingerprintIndex(
+            os.path.join(self.directory, 'index'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_short_file(self):
+        errors = self.index.add([self.short_path, self.long_path], jobs=1)
+        self.assertEqual(errors, [])
+        reopened = siglab_search.FingerprintIndex(self.index.directory)
+        self.assertEqual(sorted(entry['path'] for entry in reopened.files),
+                         sorted([self.long_path, self.short_path]))
+        vectors, files, frames = reopened.summaries()
+        self.assertTrue(len(vectors))
+        self.assertTrue((files == reopened._by_path[self.long_path]).all())
+
+    def test_start_time_is_float(self):
+        self.index.add([self.long_path, self.short_path], jobs=1)
+        for exhaustive in (False, True):
+            matches = self.index.search(self.long_path, 0.5, 0.5,
+                                        exhaustive=exhaustive)
+            self.assertTrue(matches)
+            for match in matches:
+                self.assertIs(type(match.start_time), float)
+            json.dumps(matches)
+
+if __name__ == '__main__':
+    unittest.main()
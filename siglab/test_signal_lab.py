@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""Regression checks of signal_lab.SignalLab analysis.
+
+Run with:
+    python -m unittest test_signal_lab
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import siglab_bench
+import signal_lab
+
+# (blocksize, overlap) pairs checked
+FRAMINGS = ((256, 0.0), (512, .5), (1024, .5), (1024, .75), (2048, .3))
+
+class StackWavTest(unittest.TestCase):
+    """Base class - opens a synthetic file of harmonic stacks as self.data."""
+
+    duration = 2.0
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'stacks.wav')
+        siglab_bench.make_stack_wav(self.path, duration=self.duration)
+        self.data = signal_lab.SignalLab(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+class BatchedFramesTest(StackWavTest):
+
+    def per_frame(self, blocksize, overlap):
+        """Return (time, pitch, goodness, entropy) from power_spectrum() and
+        cepstrum() of one frame at a time, stepping as the original loop did."""
+        data = self.data
+        dur_of_N = blocksize*data.delta_t
+        end_time = (data.n_wav_samps-1)*data.delta_t
+        inc_t = dur_of_N - overlap*dur_of_N
+        time, pitch, goodness, entropy = [], [], [], []
+        offset = 0.0
+        while offset + dur_of_N < end_time:
+            frame = data.power_spectrum(offset, blocksize, plot_it=False)
+            frame_goodness, frame_pitch = data.cepstrum(blocksize//2, plot_it=False)
+            power = data.frame_power(frame)
+            time.append(offset + 0.5*dur_of_N)
+            pitch.append(frame_pitch)
+            goodness.append(frame_goodness)
+            entropy.append(numpy.exp(numpy.log(power).mean())/power.mean())
+            offset += inc_t
+        return [numpy.array(values) for values in (time, pitch, goodness, entropy)]
+
+    def test_same_as_per_frame(self):
+        for blocksize, overlap in FRAMINGS:
+            expected = self.per_frame(blocksize, overlap)
+            actual = self.data.pitch_features(blocksize, overlap)
+            for name, want, got in zip(('time', 'pitch', 'goodness', 'entropy'),
+                                       expected, actual):
+                numpy.testing.assert_allclose(
+                    got, want, rtol=1e-9, err_msg='{} {} {}'.format(
+                        name, blocksize, overlap))
+
+    def test_batch_size_does_not_matter(self):
+        for compact in (False, True):
+            data = signal_lab.SignalLab(self.path, compact=compact)
+            expected = data.song_features(1024, .5)
+            data.frames_per_batch = 7
+            actual = data.song_features(1024, .5)
+            for name in expected.dtype.names:
+                numpy.testing.assert_array_equal(actual[name], expected[name])
+
+class SegmentsTest(StackWavTest):
+
+    def test_workers_same_as_serial(self):
+        for blocksize, overlap in FRAMINGS:
+            expected_features = self.data.song_features(blocksize, overlap)
+            expected_stacks = self.data.goodness_of_pitch(blocksize, overlap,
+                                                          plot_it=False)
+            self.assertTrue(expected_stacks)
+            for workers, processes in ((2, False), (3, False), (3, True)):
+                features = self.data.song_features(blocksize, overlap,
+                                                   workers=workers,
+                                                   processes=processes)
+                for name in expected_features.dtype.names:
+                    numpy.testing.assert_array_equal(features[name],
+                                                     expected_features[name])
+                stacks = self.data.goodness_of_pitch(
+                    blocksize, overlap, plot_it=False, workers=workers,
+                    processes=processes)
+                self.assertEqual(stacks, expected_stacks)
+
+class GateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sound.wav')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_auto_gate(self, silent_fraction):
+        data = signal_lab.SignalLab(self.path)
+        silent = data.song_features(gate='auto')['silent']
+        self.assertAlmostEqual(silent.mean(), silent_fraction, delta=0.15)
+        return data
+
+    def test_continuous_tone_not_gated(self):
+        siglab_bench.make_tone_wav(self.path, duration=2.0)
+        data = self.check_auto_gate(0.0)
+        self.assertEqual(data.goodness_of_pitch(plot_it=False, gate='auto'),
+                         data.goodness_of_pitch(plot_it=False))
+
+    def test_sweep_not_gated(self):
+        siglab_bench.make_tone_wav(self.path, duration=2.0, sweep=4000.0)
+        data = self.check_auto_gate(0.0)
+        self.assertEqual(data.goodness_of_pitch(plot_it=False, gate='auto'),
+                         data.goodness_of_pitch(plot_it=False))
+
+    def test_noise_not_gated(self):
+        siglab_bench.make_noise_wav(self.path, duration=2.0)
+        data = self.check_auto_gate(0.0)
+        self.assertEqual(data.goodness_of_pitch(plot_it=False, gate='auto'),
+                         data.goodness_of_pitch(plot_it=False))
+
+    def test_gaps_gated(self):
+        siglab_bench.make_stack_wav(self.path, duration=2.0, stack_dur=0.1,
+                                    gap_dur=0.3)
+        data = self.check_auto_gate(0.6)
+        # one stack per stack_dur+gap_dur - noise frames in the gaps can't
+        # join stacks
+        self.assertEqual(len(data.goodness_of_pitch(plot_it=False, gate='auto')), 5)
+
+class FmTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tone.wav')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def median_fm(self, sweep):
+        siglab_bench.make_tone_wav(self.path, duration=1.0, sweep=sweep)
+        fm = signal_lab.SignalLab(self.path).song_features(features=('fm',))['fm']
+        return numpy.nanmedian(fm)
+
+    def test_steady_tone(self):
+        self.assertLess(self.median_fm(0.0), 1.0)
+
+    def test_sweep(self):
+        self.assertGreater(self.median_fm(8000.0), 45.0)
+
+if __name__ == '__main__':
+    unittest.main()